@@ -1,14 +1,31 @@
+import argparse
+import itertools
 import json
-import requests
+import os
+import random
+import time
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 from datetime import datetime
+import columnar_io
+import date_utils
+import http_client
+import marketplace_query
+import record_io
 
 # URL for the EclipseFdn auto-publish allow-list
 AUTO_PUBLISH_URL = "https://raw.githubusercontent.com/EclipseFdn/publish-extensions/refs/heads/master/extensions.json"
 OUTPUT_FILE = ('all_extensions_metadata.csv')
 VS_CODE_LICENSES_FILE = 'vs_code_licenses.json'
 VS_CODE_EXTENSIONS_FILE = 'vs_code_extensions.json'
+VS_CODE_EXTENSIONS_NDJSON_FILE = 'vs_code_extensions.ndjson'
 OPEN_VSX_EXTENSIONS_FILE = 'open_vsx_extensions.json'
+OPEN_VSX_EXTENSIONS_NDJSON_FILE = 'open_vsx_extensions.ndjson'
+OPEN_VSX_EXTENSIONS_PARQUET_FILE = columnar_io.OPEN_VSX_EXTENSIONS_FILE_NAME
+VS_CODE_EXTENSIONS_PARQUET_FILE = columnar_io.VS_CODE_EXTENSIONS_FILE_NAME
+VS_CODE_LICENSES_PARQUET_FILE = columnar_io.VS_CODE_LICENSES_FILE_NAME
 MS_OWNED_NAMESPACES = ['ms-python',
                        'ms-toolsai',
                        'ms-vscode',
@@ -23,15 +40,31 @@ MS_OWNED_NAMESPACES = ['ms-python',
                        'MS-SarifVSCode',
                        'msjsdiag'
                        ]
-
-
-def get_vscode_installs(extension_data):
-    """Helper to extract install count from the specific VS Code stats structure."""
-    stats = extension_data.get('statistics', [])
-    for stat in stats:
-        if stat.get('statisticName') == 'install':
-            return stat.get('value', 0)
-    return 0
+VS_CODE_COLUMNS = ['VS Code Publisher', 'VS Code Name', 'VS Code Version', 'VS Code Last-Updated',
+                   'VS Code License', 'VS Code Installs', 'join_key']
+OPEN_VSX_COLUMNS = ['Open VSX Namespace', 'Open VSX Name', 'Open VSX Publisher', 'Open VSX Version',
+                    'Open VSX Last-Updated', 'Open VSX Downloads', 'Open VSX Verified', 'Open VSX License',
+                    'join_key']
+# Records converted to Arrow arrays at a time
+CHUNK_SIZE = 10000
+# The fields of the crawler records the DataFrames are built from, other fields are skipped
+VS_CODE_RECORD_TYPE = pa.struct([
+    ('publisher', pa.struct([('publisherName', pa.string())])),
+    ('extensionName', pa.string()),
+    ('lastUpdated', pa.string()),
+    ('versions', pa.list_(pa.struct([('version', pa.string())]))),
+    ('statistics', pa.list_(pa.struct([('statisticName', pa.string()), ('value', pa.float64())]))),
+])
+OPEN_VSX_RECORD_TYPE = pa.struct([
+    ('namespace', pa.string()),
+    ('name', pa.string()),
+    ('publishedBy', pa.struct([('loginName', pa.string())])),
+    ('version', pa.string()),
+    ('timestamp', pa.string()),
+    ('downloadCount', pa.int64()),
+    ('verified', pa.bool_()),
+    ('license', pa.string()),
+])
 
 
 def load_json_file(filepath):
@@ -53,7 +86,7 @@ def fetch_auto_publish_set():
     """
     print(f"Fetching auto-publish list from GitHub...")
     try:
-        response = requests.get(AUTO_PUBLISH_URL, timeout=10)
+        response = http_client.get(AUTO_PUBLISH_URL, timeout=10)
         response.raise_for_status()
         data = response.json()
 
@@ -69,54 +102,35 @@ def fetch_auto_publish_set():
         return set()
 
 
-def main():
-    # 1. Load Data Sources
-    vscode_extensions = load_json_file(VS_CODE_EXTENSIONS_FILE)
-    if not vscode_extensions:
-        print(f"No VS Code data found: {VS_CODE_EXTENSIONS_FILE}. Exiting.")
-        return
-    openvsx_extensions = load_json_file(OPEN_VSX_EXTENSIONS_FILE)
-    if not openvsx_extensions:
-        print(f"No Open VSX data found: {OPEN_VSX_EXTENSIONS_FILE}. Exiting.")
-        return
-    vscode_licenses = load_json_file(VS_CODE_LICENSES_FILE)
-    if not vscode_licenses:
-        print(f"No VS Code licenses data found: {VS_CODE_LICENSES_FILE}. Exiting.")
-        return
-    auto_publish_ids = fetch_auto_publish_set()
-    if len(auto_publish_ids) == 0:
-        print("Auto-publish list is empty. Exiting.")
-
-    # 2. Process VS Code Data
-    print("Processing VS Code extensions...")
-    vs_rows = []
-    for ext in vscode_extensions:
-        pub = ext['publisher']['publisherName']
-        name = ext['extensionName']
-        vscode_id = f"{pub}.{name}"
-        last_Updated_str = ext['lastUpdated']
-        last_Updated = datetime.fromisoformat(last_Updated_str)
-        version = ext['versions'][0]['version']
-        license_info = vscode_licenses.get(vscode_id)
+def get_vscode_columns(extensions, licenses):
+    """
+    Extracts the VS Code columns of each extension record into column lists, one
+    record at a time. Kept as the reference for get_vscode_frame() in benchmark().
+    """
+    columns = {name: [] for name in VS_CODE_COLUMNS}
+    for record in marketplace_query.iter_records(extensions):
+        vscode_id = record.vscode_id
+        last_Updated = datetime.fromisoformat(record.last_updated)
+        license_info = licenses.get(vscode_id)
         if license_info is not None:
             license = license_info.get('license')
         else:
             license = None
-        vs_rows.append({
-            'VS Code Publisher': pub,
-            'VS Code Name': name,
-            'VS Code Version': version,
-            'VS Code Last-Updated': last_Updated,
-            'VS Code License': license,
-            'VS Code Installs': get_vscode_installs(ext),
-            # Normalized key for joining
-            'join_key': vscode_id.lower()
-        })
+        columns['VS Code Publisher'].append(record.publisher_name)
+        columns['VS Code Name'].append(record.extension_name)
+        columns['VS Code Version'].append(record.version)
+        columns['VS Code Last-Updated'].append(last_Updated)
+        columns['VS Code License'].append(license)
+        columns['VS Code Installs'].append(record.installs)
+        # Normalized key for joining
+        columns['join_key'].append(vscode_id.lower())
+    return columns
 
-    # 3. Process Open VSX Data
-    print("Processing Open VSX extensions...")
-    ovsx_rows = []
-    for ext in openvsx_extensions:
+
+def get_openvsx_columns(extensions):
+    """Extracts the Open VSX columns of each extension record into column lists, one record at a time."""
+    columns = {name: [] for name in OPEN_VSX_COLUMNS}
+    for ext in extensions:
         namespace = ext.get('namespace', '')
         name = ext.get('name', '')
         # Extract the specific publisher login name (e.g. "PolyMeilex" user vs "PolyMeilex" namespace)
@@ -126,22 +140,210 @@ def main():
         ovsx_version = ext.get('version')
 
         if namespace and name:
-            ovsx_rows.append({
-                'Open VSX Namespace': namespace,
-                'Open VSX Name': name,
-                'Open VSX Publisher': publisher,
-                'Open VSX Version': ovsx_version,
-                'Open VSX Last-Updated': ovsx_date,
-                'Open VSX Downloads': ext.get('downloadCount', 0),
-                'Open VSX Verified': ext.get('verified'),
-                'Open VSX License': ext.get('license'),
-                # Normalized key for joining uses Namespace (where the extension lives)
-                'join_key': f"{namespace}.{name}".lower()
-            })
+            columns['Open VSX Namespace'].append(namespace)
+            columns['Open VSX Name'].append(name)
+            columns['Open VSX Publisher'].append(publisher)
+            columns['Open VSX Version'].append(ovsx_version)
+            columns['Open VSX Last-Updated'].append(ovsx_date)
+            columns['Open VSX Downloads'].append(ext.get('downloadCount', 0))
+            columns['Open VSX Verified'].append(ext.get('verified'))
+            columns['Open VSX License'].append(ext.get('license'))
+            # Normalized key for joining uses Namespace (where the extension lives)
+            columns['join_key'].append(f"{namespace}.{name}".lower())
+    return columns
+
+
+def iter_chunks(records, size=CHUNK_SIZE):
+    iterator = iter(records)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def get_vscode_installs_column(statistics):
+    """
+    Vectorized MarketplaceExtension.installs over an Arrow list array of statistics. Returns
+    the value of the first install statistic of each extension, or 0.
+    """
+    stats = pc.list_flatten(statistics)
+    parents = pc.list_parent_indices(statistics).to_numpy()
+    is_install = pc.fill_null(pc.equal(stats.field('statisticName'), 'install'), False).to_numpy(zero_copy_only=False)
+    values = pc.fill_null(stats.field('value'), 0).to_numpy(zero_copy_only=False)
+    installs = np.zeros(len(statistics), dtype='int64')
+    # np.unique returns the index of the first install statistic of each extension
+    extensions, first = np.unique(parents[is_install], return_index=True)
+    installs[extensions] = values[is_install][first]
+    return installs
+
+
+def to_timestamps(strings):
+    """Parses an Arrow array of ISO 8601 strings like datetime.fromisoformat(), see columnar_io.parse_timestamps()."""
+    return columnar_io.parse_timestamps(strings).to_pandas()
+
+
+def get_vscode_frame(extensions, licenses):
+    """
+    Builds the VS Code DataFrame from extension records, CHUNK_SIZE records at a time
+    so the records can be streamed. Each chunk is converted to Arrow arrays of just the
+    fields in VS_CODE_RECORD_TYPE, and the columns are computed from those a whole
+    column at a time. Returns None if there are no records.
+    """
+    license_ids = pa.array(list(licenses.keys()), pa.string())
+    license_names = pa.array([license_info.get('license') for license_info in licenses.values()], pa.string())
+    frames = []
+    for chunk in iter_chunks(extensions):
+        records = pa.array(chunk, type=VS_CODE_RECORD_TYPE)
+        publishers = pc.struct_field(records, ['publisher', 'publisherName'])
+        names = records.field('extensionName')
+        vscode_ids = pc.binary_join_element_wise(publishers, names, '.')
+        frames.append(pd.DataFrame({
+            'VS Code Publisher': publishers.to_pandas(),
+            'VS Code Name': names.to_pandas(),
+            'VS Code Version': pc.list_element(records.field('versions'), 0).field('version').to_pandas(),
+            'VS Code Last-Updated': to_timestamps(records.field('lastUpdated')),
+            'VS Code License': pc.take(license_names, pc.index_in(vscode_ids, value_set=license_ids)).to_pandas(),
+            'VS Code Installs': get_vscode_installs_column(records.field('statistics')),
+            # Normalized key for joining
+            'join_key': pc.utf8_lower(vscode_ids).to_pandas()
+        }))
+    if not frames:
+        return None
+    return pd.concat(frames, ignore_index=True)
+
+
+def get_openvsx_frame(extensions):
+    """Builds the Open VSX DataFrame from extension records, see get_vscode_frame()."""
+    frames = []
+    for chunk in iter_chunks(extensions):
+        records = pa.array(chunk, type=OPEN_VSX_RECORD_TYPE)
+        namespaces = records.field('namespace')
+        names = records.field('name')
+        keep = pc.and_(pc.fill_null(pc.greater(pc.utf8_length(namespaces), 0), False),
+                       pc.fill_null(pc.greater(pc.utf8_length(names), 0), False))
+        timestamps = to_timestamps(records.field('timestamp'))
+        records = records.filter(keep)
+        namespaces = records.field('namespace')
+        names = records.field('name')
+        frames.append(pd.DataFrame({
+            'Open VSX Namespace': namespaces.to_pandas(),
+            'Open VSX Name': names.to_pandas(),
+            # The specific publisher login name (e.g. "PolyMeilex" user vs "PolyMeilex" namespace)
+            'Open VSX Publisher': pc.fill_null(pc.struct_field(records, ['publishedBy', 'loginName']), 'Unknown').to_pandas(),
+            'Open VSX Version': records.field('version').to_pandas(),
+            'Open VSX Last-Updated': timestamps[keep.to_numpy(zero_copy_only=False)].reset_index(drop=True),
+            'Open VSX Downloads': pc.fill_null(records.field('downloadCount'), 0).to_pandas(),
+            'Open VSX Verified': records.field('verified').to_pandas(),
+            'Open VSX License': records.field('license').to_pandas(),
+            # Normalized key for joining uses Namespace (where the extension lives)
+            'join_key': pc.utf8_lower(pc.binary_join_element_wise(namespaces, names, '.')).to_pandas()
+        }))
+    if not frames:
+        return None
+    df_ovsx = pd.concat(frames, ignore_index=True)
+    return df_ovsx if len(df_ovsx) > 0 else None
 
-    # 4. Create DataFrames
-    df_vs = pd.DataFrame(vs_rows)
-    df_ovsx = pd.DataFrame(ovsx_rows)
+
+def load_frame(ndjson_filepath, json_filepath, get_frame, *args):
+    """
+    Streams crawler output, preferring the NDJSON file over the JSON array file, through
+    get_frame. Returns a DataFrame, or None if the input can't be read or is empty.
+    """
+    try:
+        return get_frame(record_io.read_records(ndjson_filepath, json_filepath), *args)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"Error loading {ndjson_filepath} or {json_filepath}: {e}")
+        return None
+
+
+def read_vscode_parquet():
+    """Builds the VS Code DataFrame from the Parquet exports, reading only the needed columns."""
+    df = columnar_io.read_parquet(VS_CODE_EXTENSIONS_PARQUET_FILE,
+                                  ['publisherName', 'extensionName', 'version', 'lastUpdated', 'installs'])
+    licenses = columnar_io.read_parquet(VS_CODE_LICENSES_PARQUET_FILE, ['extensionId', 'license'])
+    vscode_ids = df['publisherName'] + '.' + df['extensionName']
+    license_map = licenses.drop_duplicates('extensionId', keep='last').set_index('extensionId')['license']
+    return pd.DataFrame({
+        'VS Code Publisher': df['publisherName'],
+        'VS Code Name': df['extensionName'],
+        'VS Code Version': df['version'],
+        'VS Code Last-Updated': df['lastUpdated'],
+        'VS Code License': vscode_ids.map(license_map),
+        'VS Code Installs': df['installs'],
+        'join_key': vscode_ids.str.lower()
+    })
+
+
+def read_openvsx_parquet():
+    """Builds the Open VSX DataFrame from the Parquet export, reading only the needed columns."""
+    df = columnar_io.read_parquet(OPEN_VSX_EXTENSIONS_PARQUET_FILE,
+                                  ['namespace', 'name', 'publisherLoginName', 'version', 'timestamp',
+                                   'downloadCount', 'verified', 'license'])
+    df = df[(df['namespace'].fillna('') != '') & (df['name'].fillna('') != '')].reset_index(drop=True)
+    return pd.DataFrame({
+        'Open VSX Namespace': df['namespace'],
+        'Open VSX Name': df['name'],
+        'Open VSX Publisher': df['publisherLoginName'].fillna('Unknown'),
+        'Open VSX Version': df['version'],
+        'Open VSX Last-Updated': df['timestamp'],
+        'Open VSX Downloads': df['downloadCount'].fillna(0).astype('int64'),
+        'Open VSX Verified': df['verified'],
+        'Open VSX License': df['license'],
+        'join_key': (df['namespace'] + '.' + df['name']).str.lower()
+    })
+
+
+def is_up_to_date(parquet_filepath, *source_filepaths):
+    """
+    Returns True if parquet_filepath exists and is at least as new as the first of
+    source_filepaths that exists, i.e. the file the records would otherwise be read from.
+    """
+    if not os.path.exists(parquet_filepath):
+        return False
+    for source_filepath in source_filepaths:
+        if os.path.exists(source_filepath):
+            return os.path.getmtime(parquet_filepath) >= os.path.getmtime(source_filepath)
+    return True
+
+
+def main():
+    # 1. Load Data Sources. The Parquet exports are used when they are at least as new
+    # as the records they were exported from, as they are much faster to read.
+    use_vscode_parquet = (is_up_to_date(VS_CODE_EXTENSIONS_PARQUET_FILE,
+                                        VS_CODE_EXTENSIONS_NDJSON_FILE, VS_CODE_EXTENSIONS_FILE)
+                          and is_up_to_date(VS_CODE_LICENSES_PARQUET_FILE, VS_CODE_LICENSES_FILE))
+    use_openvsx_parquet = is_up_to_date(OPEN_VSX_EXTENSIONS_PARQUET_FILE,
+                                        OPEN_VSX_EXTENSIONS_NDJSON_FILE, OPEN_VSX_EXTENSIONS_FILE)
+    if not use_vscode_parquet:
+        vscode_licenses = load_json_file(VS_CODE_LICENSES_FILE)
+        if not vscode_licenses:
+            print(f"No VS Code licenses data found: {VS_CODE_LICENSES_FILE}. Exiting.")
+            return
+    auto_publish_ids = fetch_auto_publish_set()
+    if len(auto_publish_ids) == 0:
+        print("Auto-publish list is empty. Exiting.")
+
+    # 2. Process VS Code Data
+    print("Processing VS Code extensions...")
+    if use_vscode_parquet:
+        df_vs = read_vscode_parquet()
+    else:
+        df_vs = load_frame(VS_CODE_EXTENSIONS_NDJSON_FILE, VS_CODE_EXTENSIONS_FILE,
+                           get_vscode_frame, vscode_licenses)
+        if df_vs is None:
+            print(f"No VS Code data found: {VS_CODE_EXTENSIONS_FILE}. Exiting.")
+            return
+
+    # 3. Process Open VSX Data
+    print("Processing Open VSX extensions...")
+    if use_openvsx_parquet:
+        df_ovsx = read_openvsx_parquet()
+    else:
+        df_ovsx = load_frame(OPEN_VSX_EXTENSIONS_NDJSON_FILE, OPEN_VSX_EXTENSIONS_FILE, get_openvsx_frame)
+        if df_ovsx is None:
+            print(f"No Open VSX data found: {OPEN_VSX_EXTENSIONS_FILE}. Exiting.")
+            return
 
     # 5. Merge DataFrames
     # Inner join finds the intersection of both registries
@@ -153,8 +355,8 @@ def main():
     merged_df['Publish Lag'] = merged_df['VS Code Last-Updated'] - merged_df['Open VSX Last-Updated']
     merged_df['Publish Lag (Days)'] = merged_df['Publish Lag'].dt.days
     merged_df['Publish Lag (Days)'] = merged_df['Publish Lag (Days)'].clip(lower=0)
-    merged_df['VS Code Last-Updated'] = merged_df['VS Code Last-Updated'].dt.strftime("%Y-%m-%d")
-    merged_df['Open VSX Last-Updated'] = merged_df['Open VSX Last-Updated'].dt.strftime("%Y-%m-%d")
+    merged_df['VS Code Last-Updated'] = date_utils.format_iso_dates(merged_df['VS Code Last-Updated'])
+    merged_df['Open VSX Last-Updated'] = date_utils.format_iso_dates(merged_df['Open VSX Last-Updated'])
     merged_df['MS Owned Namespace'] = merged_df['Open VSX Namespace'].isin(MS_OWNED_NAMESPACES)
 
     # 7. Final Formatting
@@ -199,5 +401,66 @@ def main():
     result_df.to_csv(OUTPUT_FILE, index=False)
 
 
+def make_synthetic_records(count):
+    """Returns count VS Code records, their licenses and count Open VSX records, shaped like the crawler output."""
+    vscode_extensions = []
+    licenses = {}
+    openvsx_extensions = []
+    for i in range(count):
+        publisher = f'publisher{i % 5000}'
+        name = f'extension{i}'
+        date = f'20{random.randint(18, 25)}-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}T10:{i % 60:02d}:00.{i % 1000:03d}Z'
+        statistics = [{'statisticName': statistic, 'value': random.randint(0, 10 ** 6)}
+                      for statistic in ['averagerating', 'ratingcount', 'install', 'updateCount'] if random.random() < 0.9]
+        vscode_extensions.append({
+            'publisher': {'publisherId': str(i), 'publisherName': publisher, 'displayName': publisher},
+            'extensionId': str(i),
+            'extensionName': name,
+            'displayName': name,
+            'lastUpdated': date,
+            'versions': [{'version': f'1.{i % 100}.0', 'lastUpdated': date,
+                          'properties': [{'key': 'Microsoft.VisualStudio.Services.Links.Source', 'value': 'https://github.com'}]}],
+            'statistics': statistics,
+        })
+        if random.random() < 0.9:
+            licenses[f'{publisher}.{name}'] = {'license': random.choice(['MIT', 'Apache', 'GPL']), 'version': '1.0.0'}
+        if random.random() < 0.5:
+            openvsx_extensions.append({
+                'namespace': publisher,
+                'name': name,
+                'version': '1.0.0',
+                'timestamp': date,
+                'publishedBy': {'loginName': f'user{i % 3000}'},
+                'downloadCount': random.randint(0, 10 ** 5),
+                'verified': random.random() < 0.5,
+                'license': 'MIT',
+            })
+    return vscode_extensions, licenses, openvsx_extensions
+
+
+def benchmark(count):
+    """Times per record extraction against get_vscode_frame()/get_openvsx_frame() and checks they agree."""
+    vscode_extensions, licenses, openvsx_extensions = make_synthetic_records(count)
+    for name, old, new, args in [
+            ('VS Code', get_vscode_columns, get_vscode_frame, (vscode_extensions, licenses)),
+            ('Open VSX', get_openvsx_columns, get_openvsx_frame, (openvsx_extensions,))]:
+        start = time.perf_counter()
+        old_df = pd.DataFrame(old(*args))
+        old_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        new_df = new(*args)
+        new_elapsed = time.perf_counter() - start
+        pd.testing.assert_frame_equal(old_df, new_df, check_dtype=False)
+        print(f'{name}: {len(args[0])} records, per record {old_elapsed:.2f}s, vectorized {new_elapsed:.2f}s')
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Join Open VSX and VS Code Marketplace extension metadata.')
+    parser.add_argument('--benchmark', type=int, metavar='COUNT',
+                        help='time record extraction on COUNT synthetic extensions instead')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,138 @@
+"""
+Columnar Parquet export of the crawler output. Each dataset has a fixed list of
+FIELDS: the column name, its Arrow type and how to extract it from a record. Only
+these projected fields are written, so readers can load just the columns they need
+instead of parsing every version and property of every extension.
+
+Timestamp columns are extracted as ISO 8601 strings and converted by Arrow, one
+column at a time, see parse_timestamps().
+
+pyarrow is optional for the crawlers: without it write_parquet() skips the export.
+"""
+import os
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Rows converted and written per Parquet row group
+BATCH_SIZE = 10000
+# Field types are pyarrow type aliases, so the FIELDS can be defined without pyarrow
+TIMESTAMP = 'timestamp'
+
+OPEN_VSX_EXTENSIONS_FILE_NAME = 'open_vsx_extensions.parquet'
+VS_CODE_EXTENSIONS_FILE_NAME = 'vs_code_extensions.parquet'
+VS_CODE_LICENSES_FILE_NAME = 'vs_code_licenses.parquet'
+
+# Open VSX extension details, see get_all_open_vsx_extensions.py
+OPEN_VSX_EXTENSIONS_FIELDS = [
+    ('namespace', 'string', lambda e: e.get('namespace')),
+    ('name', 'string', lambda e: e.get('name')),
+    ('version', 'string', lambda e: e.get('version')),
+    ('timestamp', TIMESTAMP, lambda e: e.get('timestamp')),
+    ('publisherLoginName', 'string', lambda e: e.get('publishedBy', {}).get('loginName')),
+    ('publisherFullName', 'string', lambda e: e.get('publishedBy', {}).get('fullName')),
+    ('license', 'string', lambda e: e.get('license')),
+    ('downloadCount', 'int64', lambda e: e.get('downloadCount')),
+    ('averageRating', 'float64', lambda e: e.get('averageRating')),
+    ('reviewCount', 'int64', lambda e: e.get('reviewCount')),
+    ('verified', 'bool', lambda e: e.get('verified')),
+    ('preRelease', 'bool', lambda e: e.get('preRelease')),
+    ('preview', 'bool', lambda e: e.get('preview')),
+    ('unrelatedPublisher', 'bool', lambda e: e.get('unrelatedPublisher')),
+    ('namespaceAccess', 'string', lambda e: e.get('namespaceAccess')),
+    ('homepage', 'string', lambda e: e.get('homepage')),
+    ('repository', 'string', lambda e: e.get('repository')),
+    ('bugs', 'string', lambda e: e.get('bugs')),
+    ('versionCount', 'int32', lambda e: len(e.get('allVersions', {}))),
+    ('fileCount', 'int32', lambda e: len(e.get('files', {}))),
+    ('dependencyCount', 'int32', lambda e: len(e.get('dependencies', []))),
+]
+
+# VS Code Marketplace query results as marketplace_query.MarketplaceExtension records,
+# see get_all_vs_marketplace_extensions.py
+VS_CODE_EXTENSIONS_FIELDS = [
+    ('extensionId', 'string', lambda e: e.extension_id),
+    ('publisherName', 'string', lambda e: e.publisher_name),
+    ('extensionName', 'string', lambda e: e.extension_name),
+    ('displayName', 'string', lambda e: e.display_name),
+    ('version', 'string', lambda e: e.version),
+    ('lastUpdated', TIMESTAMP, lambda e: e.last_updated),
+    ('versionLastUpdated', TIMESTAMP, lambda e: e.version_last_updated),
+    ('publishedDate', TIMESTAMP, lambda e: e.published_date),
+    ('installs', 'int64', lambda e: int(e.installs or 0)),
+    ('averageRating', 'float64', lambda e: e.statistics.get('averagerating')),
+    ('ratingCount', 'int64', lambda e: int(e.statistics.get('ratingcount') or 0)),
+    ('repository', 'string', lambda e: e.repository),
+    ('pricing', 'string', lambda e: e.pricing),
+]
+
+# vs_code_licenses.json entries as (extension id, license), see get_vs_license_info.py
+VS_CODE_LICENSES_FIELDS = [
+    ('extensionId', 'string', lambda item: item[0]),
+    ('license', 'string', lambda item: item[1].get('license')),
+    ('version', 'string', lambda item: item[1].get('version')),
+]
+
+def get_arrow_type(type_name):
+    if type_name == TIMESTAMP:
+        return pa.timestamp('us', tz='UTC')
+    return pa.type_for_alias(type_name)
+
+def get_schema(fields):
+    return pa.schema([(name, get_arrow_type(type_name)) for name, type_name, extract in fields])
+
+def parse_timestamps(strings):
+    """
+    Converts an Arrow array of ISO 8601 strings to UTC timestamps, accepting the forms
+    datetime.fromisoformat() does but Arrow's cast doesn't: fractions finer than
+    microseconds are truncated, and values without an offset are taken as UTC.
+    """
+    strings = pc.replace_substring_regex(strings, r'(\.\d{6})\d+', r'\1')
+    strings = pc.replace_substring_regex(strings, r'^(\d{4}-\d{2}-\d{2})$', r'\1T00:00:00')
+    strings = pc.replace_substring_regex(strings, r'([T ][\d:.]+)$', r'\1+00:00')
+    return strings.cast(get_arrow_type(TIMESTAMP))
+
+def to_record_batch(rows, fields):
+    arrays = []
+    for name, type_name, extract in fields:
+        values = [extract(row) for row in rows]
+        if type_name == TIMESTAMP:
+            arrays.append(parse_timestamps(pa.array(values, pa.string())))
+        else:
+            arrays.append(pa.array(values, get_arrow_type(type_name)))
+    return pa.RecordBatch.from_arrays(arrays, schema=get_schema(fields))
+
+def write_parquet(records, filename, fields):
+    """
+    Writes the projected fields of records to a Parquet file, BATCH_SIZE records at
+    a time, and returns the number of rows. The file is written to a temporary file
+    and renamed, so readers never see a partial file. Returns None without writing
+    anything if pyarrow is not installed.
+    """
+    if pa is None:
+        print(f'pyarrow is not installed, skipping {filename}')
+        return None
+    temp_filename = filename + '.tmp'
+    count = 0
+    with pq.ParquetWriter(temp_filename, get_schema(fields), compression='zstd') as writer:
+        rows = []
+        for record in records:
+            rows.append(record)
+            if len(rows) == BATCH_SIZE:
+                writer.write_batch(to_record_batch(rows, fields))
+                count += len(rows)
+                rows = []
+        if len(rows) > 0 or count == 0:
+            writer.write_batch(to_record_batch(rows, fields))
+            count += len(rows)
+    os.replace(temp_filename, filename)
+    return count
+
+def read_parquet(filename, columns=None):
+    """Returns the given columns of a Parquet file, or all of them, as a DataFrame. Requires pyarrow."""
+    if pa is None:
+        raise ImportError(f'pyarrow is required to read {filename}')
+    return pq.read_table(filename, columns=columns).to_pandas()
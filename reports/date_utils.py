@@ -0,0 +1,95 @@
+"""
+Date formatting shared by the report scripts. The CSV files show dates as
+M/D/YYYY, without zero padding. format_date() builds that from the YYYY-MM-DD
+prefix of an ISO 8601 timestamp with plain integer parsing, which unlike
+strftime('%-m/%-d/%Y') works on every platform, and memoizes the result: a crawl
+has tens of thousands of timestamps but only a few thousand distinct days.
+
+format_dates() and format_iso_dates() do the same for a whole pandas Series.
+
+Run this module to benchmark convert_date_str() against the original
+strptime/strftime round trip.
+"""
+import argparse
+import random
+import time
+from datetime import date, datetime
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+# Distinct days remembered by format_date(), about 11 years' worth
+DATE_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def format_date(date_prefix):
+    """Returns a YYYY-MM-DD string as M/D/YYYY. Raises ValueError if it isn't a valid date."""
+    year, month, day = date_prefix.split('-')
+    parsed = date(int(year), int(month), int(day))
+    return f'{parsed.month}/{parsed.day}/{parsed.year}'
+
+def convert_date_str(input_str):
+    """Returns the date of an ISO 8601 timestamp, e.g. 2024-03-05T10:00:00Z, as M/D/YYYY."""
+    return format_date(input_str[0:input_str.find('T')])
+
+def convert_date_str_with_strptime(input_str):
+    """The original implementation, kept as the reference for benchmark()."""
+    date_str = input_str[0:input_str.find('T')]
+    parsed = datetime.strptime(date_str, '%Y-%m-%d')
+    return parsed.strftime("%-m/%-d/%Y")
+
+def to_days(values):
+    """
+    Returns a Series of timestamps or ISO 8601 strings as a datetime64[D] array and a
+    mask of the missing values. Timezone aware timestamps keep their local date.
+    """
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        values = pd.to_datetime(values.str.slice(0, 10), format='%Y-%m-%d')
+    elif values.dt.tz is not None:
+        values = values.dt.tz_localize(None)
+    days = values.to_numpy().astype('datetime64[D]')
+    return days, np.isnat(days)
+
+def format_dates(values):
+    """Vectorized convert_date_str(), missing values stay missing."""
+    days, missing = to_days(values)
+    months = days.astype('datetime64[M]')
+    years = pd.Series(months.astype('datetime64[Y]').astype('int64') + 1970, index=values.index).astype(str)
+    month_numbers = pd.Series(months.astype('int64') % 12 + 1, index=values.index).astype(str)
+    day_numbers = pd.Series((days - months).astype('int64') + 1, index=values.index).astype(str)
+    formatted = (month_numbers + '/' + day_numbers + '/' + years).astype(object)
+    return formatted.mask(missing, np.nan)
+
+def format_iso_dates(values):
+    """Returns a Series of timestamps or ISO 8601 strings as YYYY-MM-DD strings, missing values stay missing."""
+    days, missing = to_days(values)
+    formatted = pd.Series(days.astype(str), index=values.index, dtype=object)
+    return formatted.mask(missing, np.nan)
+
+def make_timestamps(count, days=3000):
+    start = date(2016, 1, 1).toordinal()
+    return [f'{date.fromordinal(start + random.randrange(days)).isoformat()}T{random.randrange(24):02d}:00:00.000Z'
+            for i in range(count)]
+
+def benchmark(count):
+    """Times convert_date_str() and format_dates() against the original and checks they agree."""
+    timestamps = make_timestamps(count)
+    format_date.cache_clear()
+    results = {}
+    for name, function in [('strptime/strftime', lambda: [convert_date_str_with_strptime(t) for t in timestamps]),
+                           ('memoized', lambda: [convert_date_str(t) for t in timestamps]),
+                           ('vectorized', lambda: format_dates(pd.Series(timestamps)).tolist())]:
+        start = time.perf_counter()
+        results[name] = function()
+        elapsed = time.perf_counter() - start
+        print(f'{name}: {elapsed:.3f}s for {count} timestamps')
+    for name, result in results.items():
+        if result != results['strptime/strftime']:
+            print(f'Mismatch: {name} differs from strptime/strftime')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark date formatting.')
+    parser.add_argument('--count', type=int, default=60000)
+    args = parser.parse_args()
+
+    benchmark(args.count)
@@ -2,68 +2,130 @@
 Script to collect metadata on all published extensions. Used by Jupyter notebooks.
 """
 import requests
-import json
-import time
+import argparse
+import os
 from datetime import datetime
+import columnar_io
+import http_client
+import record_io
 
 API_ENDPOINT = "https://open-vsx.org/api"
 
+NDJSON_FILENAME = 'open_vsx_extensions.ndjson'
 JSON_FILENAME = 'open_vsx_extensions.json'
 TSV_FILENAME = 'open_vsx_extensions.tsv'
-
-def retrieve_extensions():
+PARQUET_FILENAME = columnar_io.OPEN_VSX_EXTENSIONS_FILE_NAME
+CHECKPOINT_FILENAME = 'open_vsx_extensions.checkpoint.json'
+# Number of records written between checkpoints
+CHECKPOINT_INTERVAL = 100
+
+# Number of extension detail requests in flight at once, and the overall
+# request rate shared by all of them. Keep the rate low enough to avoid 429s.
+MAX_WORKERS = 8
+REQUESTS_PER_SECOND = 20
+
+# Search result fields that change without a new version being published. In
+# incremental mode these are copied onto the previously fetched detail JSON.
+SEARCH_STATISTICS = ['downloadCount', 'averageRating', 'reviewCount']
+
+def retrieve_extensions(api_endpoint=API_ENDPOINT, raise_errors=False):
+    """
+    Returns the search results for every extension. A failed page ends the search
+    with the results so far, or raises if raise_errors is set.
+    """
     extensions = []
     done = False
     offset = 0
     while not done:
-        search_url = f'{API_ENDPOINT}/-/search?size=100&offset={offset}'
+        search_url = f'{api_endpoint}/-/search?size=100&offset={offset}'
         try:
-            response = requests.get(search_url)
+            response = http_client.get(search_url)
             response.raise_for_status()
             results = response.json()
-            extensions = extensions + results['extensions']
+            extensions.extend(results['extensions'])
             offset = len(extensions) 
             print(f'Retrieved {len(extensions)} extensions')
             if len(extensions) == results['totalSize']:
                 done = True
         except Exception as e:
+            if raise_errors:
+                raise
             print(f'{datetime.now()}: {e}')
             done = True
 
     return extensions
 
-def get_extension(extension):
+def get_extension(extension, rate_limiter=None):
     extension_url = f'{API_ENDPOINT}/{extension['namespace']}/{extension['name']}'
-    retry_count = 5
-    while retry_count > 0:
-        try:
-            response = requests.get(extension_url)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print("%s: %s" % (datetime.now(), e))
-            retry_count -= 1
-            time.sleep(2)
+    try:
+        # Always revalidated, an unchanged extension costs a 304 but a changed one is never served stale
+        response = http_client.get(extension_url, cached=True, ttl=0, rate_limiter=rate_limiter)
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        print("%s: %s" % (datetime.now(), e))
 
     return None
 
-def get_all_extensions():
+def get_extension_key(extension):
+    return f'{extension['namespace']}.{extension['name']}'
+
+def load_previous_extensions():
+    """Returns the extensions of a previous crawl keyed by namespace.name."""
+    try:
+        return {get_extension_key(extension): extension
+                for extension in record_io.read_records(NDJSON_FILENAME, JSON_FILENAME)}
+    except (FileNotFoundError, ValueError) as e:
+        print(f'No previous crawl loaded: {e}')
+        return {}
+
+def is_unchanged(extension, previous_extension):
+    return (previous_extension is not None
+            and previous_extension.get('version') == extension.get('version')
+            and previous_extension.get('timestamp') == extension.get('timestamp'))
+
+def iter_all_extensions(max_workers=MAX_WORKERS, requests_per_second=REQUESTS_PER_SECOND, incremental=False, skip_keys=None):
+    """
+    Yields the detail JSON of every extension, fetched using up to max_workers
+    concurrent requests. Results are yielded in search order regardless of
+    completion order. With incremental set, only extensions whose version or
+    timestamp differ from the previous crawl are fetched, the rest are reused.
+    Extensions whose namespace.name is in skip_keys are left out.
+    """
     count = 1
-    all_extensions = []
     extensions = retrieve_extensions()    
-    print(f'\n\nStarting: {datetime.now()}')
-    for extension in extensions:
-        results = get_extension(extension)
-        if results is None:
-            print(f'Error retrieving {extension['url']}')
-        else:
-            all_extensions.append(results)
-        if int(count/100) == count/100:
-            print(f'Processed {count} of {len(extensions)}.')
-        count += 1
-    print(f'\n\nFinished {count} API Calls: {datetime.now()}')
-
-    return all_extensions
+    if skip_keys:
+        extensions = [extension for extension in extensions if get_extension_key(extension) not in skip_keys]
+    previous_extensions = load_previous_extensions() if incremental else {}
+    to_fetch = [extension for extension in extensions
+                if not is_unchanged(extension, previous_extensions.get(get_extension_key(extension)))]
+    print(f'\n\nStarting: {datetime.now()}. Fetching {len(to_fetch)} of {len(extensions)} extensions.')
+    rate_limiter = http_client.RateLimiter(requests_per_second)
+    fetch_keys = set(get_extension_key(extension) for extension in to_fetch)
+    with http_client.request_executor(max_workers) as executor:
+        all_results = executor.map(lambda extension: get_extension(extension, rate_limiter), to_fetch)
+        for extension in extensions:
+            key = get_extension_key(extension)
+            results = None
+            if key in fetch_keys:
+                results = next(all_results)
+                if results is None:
+                    print(f'Error retrieving {extension['url']}')
+                if int(count/100) == count/100:
+                    print(f'Processed {count} of {len(to_fetch)}.')
+                count += 1
+            if results is None and key in previous_extensions:
+                # Unchanged, or the fetch failed and the previous details are the best we have
+                results = previous_extensions.pop(key)
+                for statistic in SEARCH_STATISTICS:
+                    if statistic in extension:
+                        results[statistic] = extension[statistic]
+            if results is not None:
+                yield results
+    print(f'\n\nFinished {count - 1} API Calls: {datetime.now()}')
+
+def get_all_extensions(max_workers=MAX_WORKERS, requests_per_second=REQUESTS_PER_SECOND, incremental=False):
+    return list(iter_all_extensions(max_workers, requests_per_second, incremental))
 
 def get_all_by_license():
     extensions_by_license = {}
@@ -81,10 +143,42 @@ def get_all_by_license():
 
     return dict(sorted(extensions_by_license.items()))
 
-def write_json_file(extensions):
-    f = open(JSON_FILENAME, 'w')
-    f.write(json.dumps(extensions, indent=4))
-    f.close()
+def crawl(max_workers=MAX_WORKERS, incremental=False, restart=False):
+    """
+    Streams all extensions to NDJSON_FILENAME as they arrive. Records go to a .partial
+    file first, which replaces NDJSON_FILENAME once the crawl is complete. A checkpoint
+    is saved every CHECKPOINT_INTERVAL records, and unless restart is set a rerun
+    after a failed crawl keeps the checkpointed records and fetches only the rest.
+    """
+    partial_filename = NDJSON_FILENAME + '.partial'
+    checkpoint = record_io.Checkpoint(CHECKPOINT_FILENAME)
+    state = None if restart else checkpoint.load()
+    done_keys = set()
+    if state is not None and os.path.exists(partial_filename):
+        count = record_io.truncate_ndjson(partial_filename, state['records'])
+        for extension in record_io.read_ndjson(partial_filename):
+            done_keys.add(get_extension_key(extension))
+        print(f'Resuming with {count} extensions from the last checkpoint')
+        writer = record_io.NdjsonWriter(partial_filename, append=True, count=count)
+    else:
+        writer = record_io.NdjsonWriter(partial_filename)
+
+    with writer:
+        for extension in iter_all_extensions(max_workers, incremental=incremental, skip_keys=done_keys):
+            writer.write(extension)
+            if writer.count % CHECKPOINT_INTERVAL == 0:
+                writer.flush()
+                checkpoint.save({'records': writer.count})
+    os.replace(partial_filename, NDJSON_FILENAME)
+    checkpoint.clear()
+    return writer.count
+
+def write_json_file():
+    record_io.compact_to_json(NDJSON_FILENAME, JSON_FILENAME)
+
+def write_parquet_file():
+    columnar_io.write_parquet(record_io.read_ndjson(NDJSON_FILENAME), PARQUET_FILENAME,
+                              columnar_io.OPEN_VSX_EXTENSIONS_FIELDS)
 
 def write_tsv_file(extensions):
     f = open(TSV_FILENAME, 'w')
@@ -102,9 +196,23 @@ def write_tsv_file(extensions):
     f.close()
 
 if __name__ == '__main__':
-    extensions = get_all_extensions()
-    write_json_file(extensions)
-    write_tsv_file(extensions)
+    parser = argparse.ArgumentParser(description='Collect metadata on all Open VSX extensions.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only fetch extensions that changed since the last crawl')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help='number of concurrent extension requests')
+    parser.add_argument('--json', action='store_true',
+                        help=f'also compact the results into {JSON_FILENAME}')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore any checkpoint from an unfinished crawl')
+    args = parser.parse_args()
+
+    count = crawl(args.workers, args.incremental, args.restart)
+    print(f'Wrote {count} extensions to {NDJSON_FILENAME}')
+    write_tsv_file(record_io.read_ndjson(NDJSON_FILENAME))
+    write_parquet_file()
+    if args.json:
+        write_json_file()
 
 
     
@@ -1,160 +1,166 @@
 """
 Script to collect metadata on all extensions published on VS Code Marketplace. Outputs 
-both a JSON and a CSV file. Note, this relies on interfaces that are not fully documented 
-and are subject to change. 
+an NDJSON, a CSV and a Parquet file, and optionally a JSON file. Note, this relies on interfaces
+that are not fully documented and are subject to change. 
 """
 
-import requests
-import json
-from datetime import datetime
-import time
-import re
+import argparse
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import columnar_io
+import date_utils
+import http_client
+import marketplace_query
+import record_io
 
 CSV_FILE_NAME = 'vs_code_extensions.csv'
+NDJSON_FILE_NAME = 'vs_code_extensions.ndjson'
 JSON_FILE_NAME = 'vs_code_extensions.json'
-
-def get_ms_info(ext):
-    extension_name = ext['extensionName']
-    publisher_name = ext['publisher']['publisherName']
-    display_name = ext['displayName'].replace(',', ' ')
-    latest_version = ext['versions'][0]['version']
-    last_updated = ext['versions'][0]['lastUpdated']
-
-    try:
-        repo = [prop for prop in ext['versions'][0]['properties'] if prop['key'] == 'Microsoft.VisualStudio.Services.Links.Source'][0]['value']
-    except Exception:
-        repo = None
-
+CHECKPOINT_FILE_NAME = 'vs_code_extensions.checkpoint.json'
+PARQUET_FILE_NAME = columnar_io.VS_CODE_EXTENSIONS_FILE_NAME
+
+# Standard VS Code Marketplace Categories
+# "Other" is essentially a catch-all that can be large, so we process it last.
+CATEGORIES = [
+    "Azure", "Data Science", "Debuggers", "Education", "Extension Packs",
+    "Formatters", "Keymaps", "Language Packs", "Linters", "Machine Learning",
+    "Notebooks", "Programming Languages", "SCM Providers", "Snippets",
+    "Testing", "Themes", "Visualization", "Other"
+]
+
+# Number of categories scraped at once. All of them share one request budget that
+# starts at REQUESTS_PER_SECOND, is halved on every 429 and slowly recovers up to
+# MAX_REQUESTS_PER_SECOND while requests succeed.
+MAX_WORKERS = 6
+REQUESTS_PER_SECOND = marketplace_query.REQUESTS_PER_SECOND
+MAX_REQUESTS_PER_SECOND = marketplace_query.MAX_REQUESTS_PER_SECOND
+
+def scrape_category(category, pages, seen_ids, lock, rate_limiter, on_page):
+    """
+    Scrapes one category starting at pages[category]. For every page, the extensions
+    not seen before are passed to on_page while holding lock, after which pages is
+    updated to the next page number. The category is removed from pages once done.
+    Errors are raised rather than skipping the rest of the category, so the crawl
+    can be resumed from the failed page.
+    """
+    print(f"--- Scraping Category: {category} ---")
+    query_pages = marketplace_query.iter_pages(marketplace_query.category_criteria(category),
+                                               start_page=pages[category], rate_limiter=rate_limiter)
     try:
-        pricing = [prop for prop in ext['versions'][0]['properties'] if prop['key'] == 'Microsoft.VisualStudio.Services.Content.Pricing'][0]['value']
-    except Exception:
-        pricing = None
-    
-    return extension_name, publisher_name, display_name, latest_version, last_updated, repo, pricing
-
-def convert_date_str(input_str):
-    date_str = input_str[0:input_str.find('T')]
-    date = datetime.strptime(date_str, '%Y-%m-%d')
-    return_str = date.strftime("%-m/%-d/%Y")
-    return return_str
-
-def get_all_extensions():
-    MS_API_URL = 'https://marketplace.visualstudio.com/_apis/public/gallery/extensionquery'
-    MS_HEADERS = {
-        'content-type': 'application/json',
-        'accept': 'application/json;api-version=3.0-preview.1',
-        'accept-encoding': 'gzip'
-    }
-
-    # Standard VS Code Marketplace Categories
-    # "Other" is essentially a catch-all that can be large, so we process it last.
-    CATEGORIES = [
-        "Azure", "Data Science", "Debuggers", "Education", "Extension Packs",
-        "Formatters", "Keymaps", "Language Packs", "Linters", "Machine Learning",
-        "Notebooks", "Programming Languages", "SCM Providers", "Snippets",
-        "Testing", "Themes", "Visualization", "Other"
-    ]
-
-    # Use a dictionary keyed by Extension ID to automatically deduplicate
-    all_extensions_dict = {}
-
-    for category in CATEGORIES:
-        print(f"--- Scraping Category: {category} ---")
-        page_number = 1
-
-        while True:
-            payload = {
-                "assetTypes": [
-                    "Microsoft.VisualStudio.Services.Icons.Default",
-                    "Microsoft.VisualStudio.Services.Icons.Branding",
-                    "Microsoft.VisualStudio.Services.Icons.Small"
-                ],
-                "filters": [
-                    {
-                        "criteria": [
-                            {
-                                "filterType": 8,
-                                "value": "Microsoft.VisualStudio.Code"
-                            },
-                            {
-                                "filterType": 10,
-                                "value": "target:\"Microsoft.VisualStudio.Code\" "
-                            },
-                            {
-                                "filterType": 12,
-                                "value": "37888"
-                            },
-                            # Add the Category Filter (Type 5)
-                            {
-                                "filterType": 5,
-                                "value": category
-                            }
-                        ],
-                        "direction": 2,  # Descending
-                        "pageSize": 1000,
-                        "pageNumber": page_number,
-                        "sortBy": 4,  # Sort by Install Count
-                        "sortOrder": 0,
-                        "pagingToken": None
-                    }
-                ],
-                "flags": 914
-            }
-
-            try:
-                response = requests.post(MS_API_URL, headers=MS_HEADERS, data=json.dumps(payload))
-                response.raise_for_status()
-                data = response.json()
-
-                # Check if 'results' exists and has data
-                if 'results' not in data or not data['results']:
-                    break
-
-                extensions = data['results'][0].get('extensions', [])
-
-                if not extensions:
-                    break
-
-                new_count = 0
+        for page_number, extensions, total in query_pages:
+            with lock:
+                new_extensions = []
                 for ext in extensions:
                     # Use extensionId as the unique key
                     ext_id = ext.get('extensionId')
-                    if ext_id and ext_id not in all_extensions_dict:
-                        all_extensions_dict[ext_id] = ext
-                        new_count += 1
+                    if ext_id and ext_id not in seen_ids:
+                        seen_ids.add(ext_id)
+                        new_extensions.append(ext)
 
                 print(
-                    f"  Page {page_number}: Found {len(extensions)} exts ({new_count} unique new). Total Unique: {len(all_extensions_dict)}")
+                    f"  {category} page {page_number}: Found {len(extensions)} exts ({len(new_extensions)} unique new). Total Unique: {len(seen_ids)}")
+                pages[category] = page_number + 1
+                on_page(new_extensions)
+    except Exception as e:
+        print(f"Error on {category} page {pages[category]}: {e}")
+        raise
+
+    with lock:
+        del pages[category]
+        on_page([])
+        print(f"--- Finished Category: {category} ---")
+
+def scrape_categories(on_page, pages=None, seen_ids=None, max_workers=MAX_WORKERS):
+    """
+    Scrapes categories concurrently under one shared, adaptive request rate. pages
+    maps each category still to be scraped to the page to start from and is kept
+    up to date as the crawl progresses. seen_ids holds the ids of extensions already
+    collected. If a category fails, the others are finished before the error is raised.
+    """
+    # Extensions are listed in several categories, deduplicate by Extension ID
+    pages = {category: 1 for category in CATEGORIES} if pages is None else pages
+    seen_ids = set() if seen_ids is None else seen_ids
+    lock = threading.Lock()
+    rate_limiter = http_client.AdaptiveRateLimiter(REQUESTS_PER_SECOND, max_rate=MAX_REQUESTS_PER_SECOND)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(scrape_category, category, pages, seen_ids, lock, rate_limiter, on_page)
+                   for category in list(pages)]
+        for future in futures:
+            future.exception()
+    for future in futures:
+        future.result()
 
-                # Increase page number
-                page_number += 1
-
-                # Sleep to be nice to the API
-                time.sleep(5)
-
-            except Exception as e:
-                print(f"Error on {category} page {page_number}: {e}")
-                break
-
-    return list(all_extensions_dict.values())
+def get_all_extensions():
+    all_extensions = []
+    scrape_categories(all_extensions.extend)
+    return all_extensions
+
+def crawl(restart=False, max_workers=MAX_WORKERS):
+    """
+    Crawls all categories into NDJSON_FILE_NAME. Records are streamed to a .partial
+    file and a checkpoint is saved after every page, so if the crawl dies a rerun
+    picks up each category from the page after the last checkpoint unless restart
+    is set.
+    """
+    partial_file_name = NDJSON_FILE_NAME + '.partial'
+    checkpoint = record_io.Checkpoint(CHECKPOINT_FILE_NAME)
+    state = None if restart else checkpoint.load()
+    seen_ids = set()
+    if state is not None and os.path.exists(partial_file_name):
+        count = record_io.truncate_ndjson(partial_file_name, state['records'])
+        for ext in record_io.read_ndjson(partial_file_name):
+            seen_ids.add(ext.get('extensionId'))
+        pages = state['pages']
+        print(f"Resuming {len(pages)} categories with {count} extensions")
+        ndjson_writer = record_io.NdjsonWriter(partial_file_name, append=True, count=count)
+    else:
+        pages = {category: 1 for category in CATEGORIES}
+        ndjson_writer = record_io.NdjsonWriter(partial_file_name)
+
+    def on_page(new_extensions):
+        for ext in new_extensions:
+            ndjson_writer.write(ext)
+        ndjson_writer.flush()
+        checkpoint.save({
+            'pages': pages,
+            'records': ndjson_writer.count
+        })
+
+    with ndjson_writer:
+        scrape_categories(on_page, pages, seen_ids, max_workers)
+
+    os.replace(partial_file_name, NDJSON_FILE_NAME)
+    checkpoint.clear()
+    print(f'Wrote {ndjson_writer.count} extensions to {NDJSON_FILE_NAME}')
 
 if __name__ == '__main__':
-
-    all_extensions = get_all_extensions()
+    parser = argparse.ArgumentParser(description='Collect metadata on all VS Code Marketplace extensions.')
+    parser.add_argument('--json', action='store_true',
+                        help=f'also compact the results into {JSON_FILE_NAME}')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore any checkpoint and crawl from the first page of every category')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help='number of categories scraped concurrently')
+    args = parser.parse_args()
+
+    crawl(args.restart, args.workers)
+    # Parse the crawl once into compact records for the CSV and Parquet files
+    records = list(marketplace_query.iter_records(record_io.read_ndjson(NDJSON_FILE_NAME)))
     # Output CSV File
     csv_file = open(CSV_FILE_NAME, 'w')
     csv_file.write("MS Publisher (Namespace), MS Extension, MS DisplayName, MS Version, MS Date, Repo\n")
-    for ext in all_extensions:
-        ms_extension_name, ms_publisher_name, ms_display_name, ms_latest_version, ms_last_updated, ms_repo, ms_pricing = get_ms_info(ext)
+    for record in records:
+        ms_extension_name, ms_publisher_name, ms_display_name, ms_latest_version, ms_last_updated, ms_repo, ms_pricing = marketplace_query.get_ms_info(record)
         csv_file.write("%s, %s, %s, %s, %s, %s\n" % (
                 ms_publisher_name,
                 ms_extension_name,
                 ms_display_name,
                 ms_latest_version,
-                convert_date_str(ms_last_updated),
+                date_utils.convert_date_str(ms_last_updated),
                 ms_repo
                 ))
-    # Output JSON File
-    json_file = open(JSON_FILE_NAME, 'w')
-    json_file.write(json.dumps(all_extensions, indent=4))
-    json_file.close()
\ No newline at end of file
+    csv_file.close()
+    columnar_io.write_parquet(records, PARQUET_FILE_NAME, columnar_io.VS_CODE_EXTENSIONS_FIELDS)
+    if args.json:
+        record_io.compact_to_json(NDJSON_FILE_NAME, JSON_FILE_NAME)
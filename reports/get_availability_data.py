@@ -2,15 +2,22 @@
 Script to collect availability data from open-vsx endpoints monitored by
 betteruptime. Used by graph_availability_trends Jupyter Notebook.Requires 
 an access token from IT team. 
+
+The SLA of every completed day is kept per monitor in a local SQLite store, so
+later runs only request the days added since. The aggregated rolling and monthly
+views are computed from that daily history.
 """
-import requests
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import numpy as np
 import os
 import calendar
+import sqlite3
+import threading
 import time
+from concurrent.futures import Future
 from urllib.parse import urlparse
 from dotenv import load_dotenv
+import http_client
 
 # Load variables from .env into os.environ
 load_dotenv()
@@ -18,25 +25,59 @@ load_dotenv()
 API_URL = 'https://betteruptime.com/api/v2'
 TOKEN = os.getenv('BETTER_STACK_TOKEN')
 HEADERS = {'Authorization': 'Bearer %s' % TOKEN}
+# Monitors are processed by MAX_WORKERS threads. Better Stack rate limits are
+# strict, so all of them share a cap of MAX_CONCURRENT_REQUESTS requests in flight.
+MAX_WORKERS = 4
+MAX_CONCURRENT_REQUESTS = 2
+SECONDS_PER_DAY = 24 * 60 * 60
+AVAILABILITY_STORE_FILE_NAME = 'availability_history.sqlite'
+# Identical calls made while one is in flight, or within COALESCE_SECONDS after it
+# completed (and within the caller's ttl), share its result instead of making
+# another request
+COALESCE_SECONDS = 60
+COALESCE_MAX_ENTRIES = 1000
+
+http_client.set_host_limit(urlparse(API_URL).hostname, MAX_CONCURRENT_REQUESTS)
+
+_recent_calls = {}
+_recent_calls_lock = threading.Lock()
 
-def make_api_call(url):
+def _prune_recent_calls(now):
+    for url in [url for url, (future, completed) in _recent_calls.items()
+                if completed is not None and now - completed >= COALESCE_SECONDS]:
+        del _recent_calls[url]
+
+def make_api_call(url, ttl=http_client.CACHE_TTL_SECONDS):
     # print("Calling %s" % url)
-    retry_count = 5
-    done = False
-    while not done:
+    now = time.monotonic()
+    with _recent_calls_lock:
+        entry = _recent_calls.get(url)
+        if entry is not None and (entry[1] is None or now - entry[1] < min(COALESCE_SECONDS, ttl)):
+            future = entry[0]
+            owner = False
+        else:
+            if len(_recent_calls) >= COALESCE_MAX_ENTRIES:
+                _prune_recent_calls(now)
+            future = Future()
+            entry = [future, None]
+            _recent_calls[url] = entry
+            owner = True
+
+    if owner:
         try:
-            response = requests.get(url, headers=HEADERS)
+            response = http_client.get(url, headers=HEADERS, cached=True, ttl=ttl)
             response.raise_for_status()
-            done = True
-        except requests.exceptions.RequestException as e:
-            if retry_count > 0:
-                print(" %s, retrying..." % e)
-                time.sleep((6 - retry_count) * 5)
-                retry_count = retry_count - 1
-            else:
-                raise
-
-    return response.json()
+            future.set_result(response.json())
+        except BaseException as e:
+            # Also on Ctrl-C, so later calls don't wait on a future that is never resolved
+            with _recent_calls_lock:
+                _recent_calls.pop(url, None)
+            future.set_exception(e)
+            raise
+        else:
+            with _recent_calls_lock:
+                entry[1] = time.monotonic()
+    return future.result()
 
 def get_all_monitors():
     all_openvsx_monitors = []
@@ -58,6 +99,16 @@ def get_all_monitors():
 def get_monitor_url(id, start_date, end_date):
     return '%s/monitors/%s/sla?from=%s&to=%s' % (API_URL, id, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
 
+def get_utc_today():
+    """Returns the start of the current UTC day, as Better Stack's days are UTC days."""
+    return datetime.combine(datetime.now(timezone.utc).date(), datetime.min.time())
+
+def get_sla_ttl(end_date):
+    # SLA figures for intervals that ended before today (UTC) no longer change
+    if end_date < get_utc_today():
+        return http_client.FOREVER
+    return 0
+
 def get_monitor_data(monitor, time_span):
     monitor_id = monitor['id']
     name = monitor['attributes']['pronounceable_name']
@@ -71,28 +122,152 @@ def get_monitor_data(monitor, time_span):
     print('processing %s' % name)
     while end_date <= today:
         availability_url = get_monitor_url(monitor_id, start_date, end_date)
-        json_results = make_api_call(availability_url)
+        json_results = make_api_call(availability_url, get_sla_ttl(end_date))
         dates.append(np.datetime64(end_date.strftime('%Y-%m-%d')))
         sla_data.append(json_results['data']['attributes']['availability'])
         downtime_url = get_monitor_url(monitor_id, start_date, start_date)
-        json_results = make_api_call(downtime_url)
+        json_results = make_api_call(downtime_url, get_sla_ttl(start_date))
         downtime_data.append(json_results['data']['attributes']['total_downtime']/60)
         start_date = start_date + timedelta(days=1)
         end_date = end_date + timedelta(days=1)
     print('finished processing')
     return name, dates, sla_data, downtime_data
 
-def get_continuous_data(time_span=30):
+class AvailabilityStore:
+    """Daily availability and downtime of each monitor, stored in SQLite."""
+    def __init__(self, filename=AVAILABILITY_STORE_FILE_NAME):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS daily_sla (
+            monitor_id TEXT,
+            day TEXT,
+            availability REAL,
+            total_downtime REAL,
+            PRIMARY KEY (monitor_id, day))''')
+        self.connection.commit()
+
+    def get_last_day(self, monitor_id):
+        with self.lock:
+            row = self.connection.execute('SELECT MAX(day) FROM daily_sla WHERE monitor_id = ?',
+                                          (str(monitor_id),)).fetchone()
+        if row[0] is None:
+            return None
+        return datetime.strptime(row[0], '%Y-%m-%d')
+
+    def append(self, monitor_id, rows):
+        """Stores (day, availability, total_downtime) rows, day being a datetime."""
+        with self.lock:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO daily_sla VALUES (?, ?, ?, ?)',
+                [(str(monitor_id), day.strftime('%Y-%m-%d'), availability, total_downtime)
+                 for day, availability, total_downtime in rows])
+            self.connection.commit()
+
+    def get_days(self, monitor_id):
+        """Returns the stored days, availability and total downtime of a monitor as arrays."""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT day, availability, total_downtime FROM daily_sla WHERE monitor_id = ? ORDER BY day',
+                (str(monitor_id),)).fetchall()
+        days = np.array([row[0] for row in rows], dtype='datetime64[D]')
+        availability = np.array([row[1] for row in rows], dtype=float)
+        downtime = np.array([row[2] for row in rows], dtype=float)
+        return days, availability, downtime
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = AvailabilityStore()
+    return _store
+
+def get_day_sla(monitor_id, day):
+    json_results = make_api_call(get_monitor_url(monitor_id, day, day), get_sla_ttl(day))
+    attributes = json_results['data']['attributes']
+    return day, attributes['availability'], attributes['total_downtime']
+
+def get_daily_history(monitor, store=None):
+    """
+    Returns days, availability and total downtime in seconds of every day from the
+    creation of monitor up to today. Completed days missing from the store are
+    requested and appended to it, today's partial figures are requested every time.
+    """
+    store = get_store() if store is None else store
+    monitor_id = monitor['id']
+    start_date = datetime.strptime(monitor['attributes']['created_at'][0:10], '%Y-%m-%d')
+    today = get_utc_today()
+    last_day = store.get_last_day(monitor_id)
+    day = start_date if last_day is None else last_day + timedelta(days=1)
+    new_rows = []
+    while day < today:
+        new_rows.append(get_day_sla(monitor_id, day))
+        day = day + timedelta(days=1)
+    if new_rows:
+        store.append(monitor_id, new_rows)
+        print('stored %s new days' % len(new_rows))
+
+    days, availability, downtime = store.get_days(monitor_id)
+    today_row = get_day_sla(monitor_id, today)
+    days = np.append(days, np.datetime64(today.strftime('%Y-%m-%d'), 'D'))
+    availability = np.append(availability, today_row[1])
+    downtime = np.append(downtime, today_row[2])
+    return days, availability, downtime
+
+def get_windowed_sla(daily_downtime, time_span):
+    """
+    Returns the availability percentage of every window of time_span + 1 days
+    (from and to dates are both included in an SLA query) in daily_downtime.
+    """
+    window_days = time_span + 1
+    if len(daily_downtime) < window_days:
+        return np.array([])
+    window_downtime = np.lib.stride_tricks.sliding_window_view(daily_downtime, window_days).sum(axis=1)
+    return 100 * (1 - window_downtime / (window_days * SECONDS_PER_DAY))
+
+def get_aggregated_monitor_data(monitor, time_span):
+    """
+    Same results as get_monitor_data, but computed from the daily history. The rolling
+    availability is derived from the daily downtime instead of being requested for
+    every window. It can differ slightly from Better Stack's own figure, which also
+    accounts for things like maintenance windows and the current partial day.
+    """
+    name = monitor['attributes']['pronounceable_name']
+    print('processing %s' % name)
+    days, availability, daily_downtime = get_daily_history(monitor)
+    sla_data = get_windowed_sla(daily_downtime, time_span)
+    dates = list(days[time_span:time_span + len(sla_data)])
+    downtime_data = (daily_downtime[:len(sla_data)] / 60).tolist()
+    print('finished processing')
+    return name, dates, sla_data.tolist(), downtime_data
+
+def process_monitors(get_data, *args):
+    """
+    Calls get_data(monitor, *args) for every open-vsx.org monitor concurrently. Each
+    monitor retries its own failed requests, so a flaky one does not hold up the
+    others. Results are returned in monitor order.
+    """
     monitors = get_all_monitors()
     results = []
-    for monitor in monitors:
-        name, dates, sla_data, downtime_data = get_monitor_data(monitor, time_span)
-        results.append({'name': name,
-                        'dates': dates,
-                        'sla_data': sla_data,
-                        'downtime_data': downtime_data})
+    with http_client.request_executor(MAX_WORKERS) as executor:
+        for name, dates, sla_data, downtime_data in executor.map(lambda monitor: get_data(monitor, *args), monitors):
+            results.append({'name': name,
+                            'dates': dates,
+                            'sla_data': sla_data,
+                            'downtime_data': downtime_data})
     return results
 
+def get_continuous_data(time_span=30, aggregate=False):
+    """
+    Returns the rolling time_span day availability of every open-vsx.org monitor. With
+    aggregate set, it is computed from the stored daily history.
+    """
+    if aggregate:
+        return process_monitors(get_aggregated_monitor_data, time_span)
+    return process_monitors(get_monitor_data, time_span)
+
 def get_monthly_monitor_data(monitor):
     monitor_id = monitor['id']
     name = monitor['attributes']['pronounceable_name']
@@ -107,28 +282,37 @@ def get_monthly_monitor_data(monitor):
         interval_days_in_month = calendar.monthrange(interval_start_date.year, interval_start_date.month)[1]
         interval_end_date = interval_start_date + timedelta(days=interval_days_in_month - interval_start_date.day)
         availability_url = get_monitor_url(monitor_id, interval_start_date, interval_end_date)
-        json_results = make_api_call(availability_url)
+        json_results = make_api_call(availability_url, get_sla_ttl(interval_end_date))
         dt = interval_start_date.strftime('%Y-%m')
         dates.append(np.datetime64(dt))
+        # The same response holds both the availability and the downtime
         sla_data.append(json_results['data']['attributes']['availability'])
-        downtime_url = get_monitor_url(monitor_id, interval_start_date, interval_end_date)
-        json_results = make_api_call(downtime_url)
         downtime_data.append(json_results['data']['attributes']['total_downtime']/60)
         interval_start_date = interval_end_date + timedelta(days=1)
 
     print('finished processing')
     return name, dates, sla_data, downtime_data
 
-def get_monthly_data():
-    monitors = get_all_monitors()
-    results = []
-    for monitor in monitors:
-        name, dates, sla_data, downtime_data = get_monthly_monitor_data(monitor)
-        results.append({'name': name,
-                        'dates': dates,
-                        'sla_data': sla_data,
-                        'downtime_data': downtime_data})
-    return results
+def get_aggregated_monthly_monitor_data(monitor):
+    """Same results as get_monthly_monitor_data, computed from the daily history."""
+    name = monitor['attributes']['pronounceable_name']
+    print('processing %s' % name)
+    days, availability, daily_downtime = get_daily_history(monitor)
+    months, month_index = np.unique(days.astype('datetime64[M]'), return_inverse=True)
+    month_downtime = np.bincount(month_index, weights=daily_downtime, minlength=len(months))
+    month_days = np.bincount(month_index, minlength=len(months))
+    sla_data = 100 * (1 - month_downtime / (month_days * SECONDS_PER_DAY))
+    print('finished processing')
+    return name, list(months), sla_data.tolist(), (month_downtime / 60).tolist()
+
+def get_monthly_data(aggregate=False):
+    """
+    Returns the monthly availability of every open-vsx.org monitor. With aggregate
+    set, it is computed from the stored daily history.
+    """
+    if aggregate:
+        return process_monitors(get_aggregated_monthly_monitor_data)
+    return process_monitors(get_monthly_monitor_data)
 
 
 if __name__ == '__main__':
@@ -7,15 +7,28 @@ web auth, not the API token:
 
 Currently there is a bug in stats that requires a token query paramater, the value of 
 which is ignored.
+
+With schedule=True, months whose report hasn't been generated yet are scheduled with
+schedule_report(), and fetched as soon as polling get_available_reports() shows they
+are ready. This can take up to SCHEDULE_TIMEOUT_SECONDS, so notebooks don't schedule
+by default.
+
+Monthly reports are fetched concurrently and saved to ADMIN_REPORTS_DIRECTORY. Only
+completed months are requested and their reports don't change, so a saved month is
+never requested again.
 """
 
-import requests
 from datetime import date
 from dateutil.relativedelta import relativedelta
 import pandas as pd
 import os
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+import http_client
+import record_io
 
 # Load variables from .env into os.environ
 load_dotenv()
@@ -23,74 +36,209 @@ load_dotenv()
 ADMIN_REPORTS_ENDPOINT = 'https://open-vsx.org/admin/'
 OPEN_VSX_ACCESS_TOKEN = os.getenv('OPEN_VSX_ACCESS_TOKEN')
 
+ADMIN_REPORTS_DIRECTORY = 'admin_reports'
+MAX_WORKERS = 6
+POLL_INTERVAL_SECONDS = 10
+POLL_MAX_INTERVAL_SECONDS = 300
+SCHEDULE_TIMEOUT_SECONDS = 30 * 60
+
 HEADERS = ['year', 'month', 'extensions', 'downloads', 'downloadsTotal', 'publishers', 'averageReviewsPerExtension', 'namespaceOwners']
 
 def get_available_reports():
-    url = f'{ADMIN_REPORTS_ENDPOINT}reports?token={ADMIN_REPORTS_ENDPOINT}'
-    response = requests.get(url)
+    url = f'{ADMIN_REPORTS_ENDPOINT}reports?token={OPEN_VSX_ACCESS_TOKEN}'
+    response = http_client.get(url)
+    response.raise_for_status()
     results = response.json()
     return results
 
 def schedule_report(year, month):
-    url = f'{ADMIN_REPORTS_ENDPOINT}report/schedule?token={ADMIN_REPORTS_ENDPOINT}'
+    url = f'{ADMIN_REPORTS_ENDPOINT}report/schedule?token={OPEN_VSX_ACCESS_TOKEN}'
     headers = {"Content-Type": "application/json"}
     payload = {
         'year': year,
         'month': month
     }
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
+    response = http_client.post(url, headers=headers, data=json.dumps(payload))
     return response.status_code
 
+def get_available_months():
+    """Returns the set of (year, month) with a generated report, or None if the list can't be read."""
+    try:
+        results = get_available_reports()
+        # Months are listed per year, e.g. {"2024": [1, 2, 3]}
+        if not isinstance(results, dict) or not all(isinstance(months, list) for months in results.values()):
+            raise ValueError(f"unexpected response {str(results)[:200]}")
+        return {(int(year), int(month)) for year, months in results.items() for month in months}
+    except Exception as e:
+        print(f"Error {e} reading available reports")
+        return None
 
-def get_publishing_data(starting_year, starting_month):
+def schedule_missing_reports(months):
+    """
+    Schedules the months that have no generated report yet. Returns the months that
+    were scheduled and still have to be waited for.
+    """
+    if len(months) == 0:
+        return set()
+    available = get_available_months()
+    if available is None:
+        print("Can't tell which reports exist, not scheduling: %s" %
+              ', '.join('%s-%s' % year_month for year_month in sorted(months)))
+        return set()
+    scheduled = set()
+    for year, month in months:
+        if (year, month) in available:
+            continue
+        status_code = schedule_report(year, month)
+        if status_code < 300:
+            print("scheduled report for %s-%s" % (year, month))
+            scheduled.add((year, month))
+        else:
+            print("%s error scheduling report for %s-%s" % (status_code, year, month))
+    return scheduled
+
+def wait_for_reports(months, timeout=SCHEDULE_TIMEOUT_SECONDS):
+    """
+    Polls the available reports with increasing intervals and yields each of months
+    once its report is ready. Months not ready within timeout seconds are skipped.
+    """
+    pending = set(months)
+    interval = POLL_INTERVAL_SECONDS
+    deadline = time.monotonic() + timeout
+    while len(pending) > 0:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print("reports not ready after %s seconds: %s" % (timeout,
+                  ', '.join('%s-%s' % year_month for year_month in sorted(pending))))
+            return
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, POLL_MAX_INTERVAL_SECONDS)
+        available = get_available_months()
+        if available is None:
+            continue
+        for year_month in sorted(pending & available):
+            pending.remove(year_month)
+            yield year_month
+
+def fetch_months(months, fetch, max_workers=MAX_WORKERS, schedule=True, timeout=SCHEDULE_TIMEOUT_SECONDS):
+    """
+    Calls fetch((year, month)) for each of months concurrently. With schedule=True,
+    months that are neither saved nor generated on the server are scheduled first and
+    fetched as they become ready, while the other months are being fetched.
+    """
+    pending = set()
+    if schedule:
+        pending = schedule_missing_reports([(year, month) for year, month in months
+                                            if not os.path.exists(get_report_file_name(year, month))])
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch, year_month) for year_month in months if year_month not in pending]
+        for year_month in wait_for_reports(pending, timeout):
+            futures.append(executor.submit(fetch, year_month))
+        for future in futures:
+            future.result()
+
+
+def get_months(starting_year, starting_month):
+    """Returns (year, month) of every completed month since the starting month."""
+    months = []
     start_date = date(starting_year, starting_month, 1)
     today = date.today()
+    while start_date.year < today.year or (start_date.year == today.year and start_date.month < today.month):
+        months.append((start_date.year, start_date.month))
+        start_date = start_date + relativedelta(months=1)
+    return months
+
+def get_report_file_name(year, month):
+    return os.path.join(ADMIN_REPORTS_DIRECTORY, f'{year}-{month:02d}.json')
+
+def get_report(year, month):
+    """Returns the admin report of a completed month, from disk if it was fetched before, or None."""
+    file_name = get_report_file_name(year, month)
+    if os.path.exists(file_name):
+        with open(file_name, 'r') as f:
+            return json.load(f)
+
+    url = f'{ADMIN_REPORTS_ENDPOINT}report?year={year}&month={month}&token={OPEN_VSX_ACCESS_TOKEN}'
+    response = http_client.get(url)
+    if response.status_code != 200:
+        print("%s error processing results for %s-%s" % (response.status_code, year, month))
+        return None
+    try:
+        json_results = response.json()
+    except Exception as e:
+        print(f"Error {e} decoding JSON results for {year}-{month}")
+        return None
+    os.makedirs(ADMIN_REPORTS_DIRECTORY, exist_ok=True)
+    record_io.write_json_atomic(file_name, json_results)
+    print("processed results for %s-%s" % (year, month))
+    return json_results
+
+def get_reports(starting_year, starting_month, max_workers=MAX_WORKERS, schedule=True):
+    """
+    Returns (year, month, report) for every completed month since the starting month
+    that has a report, in month order. Months are fetched concurrently, see fetch_months().
+    """
+    months = get_months(starting_year, starting_month)
+    reports = {}
+    def fetch(year_month):
+        reports[year_month] = get_report(*year_month)
+    fetch_months(months, fetch, max_workers, schedule)
+    return [(year, month, reports[(year, month)]) for year, month in months if reports.get((year, month)) is not None]
+
+def extract_publishing_data(reports):
     data = {}
     for header in HEADERS:
         data[header] = []
-    while start_date.year < today.year or (start_date.year == today.year and start_date.month < today.month):
-        url = f'{ADMIN_REPORTS_ENDPOINT}report?year={start_date.year}&month={start_date.month}&token={OPEN_VSX_ACCESS_TOKEN}'
-        response = requests.get(url)
-        if response.status_code == 200:
-            try:
-                json_results = response.json()
-                for col in HEADERS:
-                    data[col].append(json_results[col])
-                print("processed results for %s-%s" % (start_date.year, start_date.month))
-            except Exception as e:
-                json_results = None
-                print(f"Error {e} decoding JSON results for {url}")
-        else:
-            print("%s error processing results for %s" % (response.status_code, url))
-        start_date = start_date + relativedelta(months=1)
+    for year, month, json_results in reports:
+        try:
+            values = [json_results[col] for col in HEADERS]
+        except Exception as e:
+            print(f"Error {e} reading results for {year}-{month}")
+            continue
+        for col, value in zip(HEADERS, values):
+            data[col].append(value)
 
     df = pd.DataFrame(data,columns=HEADERS)
     return df
 
+def get_publishing_data(starting_year, starting_month):
+    return extract_publishing_data(get_reports(starting_year, starting_month))
+
+def pivot_most_active_data(dates, unique, records):
+    """
+    Pivots long format (date, item, value) records into one row per date and one
+    column per unique item, in the order items were first seen. Cells without a
+    record are empty, and a later record for the same date and item replaces an
+    earlier one.
+    """
+    long_df = pd.DataFrame(records, columns=['date', 'item', 'value'])
+    long_df = long_df.drop_duplicates(['date', 'item'], keep='last')
+    df = long_df.pivot(index='date', columns='item', values='value')
+    df = df.reindex(index=dates, columns=list(unique))
+    # Missing cells turn integer columns into floats, keep complete ones as integers
+    if pd.api.types.is_integer_dtype(long_df['value']):
+        complete = df.columns[df.notna().all()]
+        df[complete] = df[complete].astype(long_df['value'].dtype)
+    df = df.reset_index(drop=True)
+    df.columns.name = None
+    df['date'] = dates
+    return df
+
 def process_most_active_data(most_active):
     resulting_dfs = {}
     for key in most_active.keys():
-        if key == 'dates':
-            dates = most_active['dates']
-        else:
-            data = {'dates': dates}
-            for entry in most_active[key]['unique']:
-                data[entry] = [None] * len(most_active['dates'])
-            for i in range(len(dates)):
-                date = dates[i]
-                for entry in most_active[key][date]:
-                    item = list(entry.values())[0]
-                    value = list(entry.values())[1]
-                    data[item][i] = value
-            df = pd.DataFrame(data, columns=most_active[key]['unique'])
-            df['date'] = dates
-            resulting_dfs[key] = df
+        if key != 'dates':
+            resulting_dfs[key] = pivot_most_active_data(most_active['dates'], most_active[key]['unique'],
+                                                        most_active[key]['records'])
     return resulting_dfs
 
-def most_active_data_append_unique(most_active, json_results, top_prop, key):
-    for item in json_results[top_prop]:
-        if item[key] not in most_active[top_prop]['unique']:
-            most_active[top_prop]['unique'].append(item[key])
+def most_active_data_append_unique(most_active, json_results, top_prop, key, year_month):
+    """Adds the entries of a month as (date, item, value) records and indexes new items."""
+    # A dict keeps the items in the order they were first seen
+    most_active[top_prop]['unique'].update(dict.fromkeys(item[key] for item in json_results[top_prop]))
+    for entry in json_results[top_prop]:
+        item, value = list(entry.values())[:2]
+        most_active[top_prop]['records'].append((year_month, item, value))
 
 def extract_most_active_data_from_json(most_active, json_results, year, month):
     top_publishers = 'topMostActivePublishingUsers'
@@ -111,51 +259,151 @@ def extract_most_active_data_from_json(most_active, json_results, year, month):
     year_month = '%s/%s' % (month, str(year)[2:])
     most_active['dates'].append(year_month)
 
-    most_active[top_publishers][year_month] = json_results[top_publishers]
-    most_active_data_append_unique(most_active, json_results, top_publishers, 'userLoginName')
-
-    most_active[top_extensions][year_month] = json_results[top_extensions]
-    most_active_data_append_unique(most_active, json_results, top_extensions, 'namespace')
+    most_active_data_append_unique(most_active, json_results, top_publishers, 'userLoginName', year_month)
+    most_active_data_append_unique(most_active, json_results, top_extensions, 'namespace', year_month)
+    most_active_data_append_unique(most_active, json_results, top_extension_versions, 'namespace', year_month)
+    most_active_data_append_unique(most_active, json_results, top_downloads, 'extensionIdentifier', year_month)
 
-    most_active[top_extension_versions][year_month] = json_results[top_extension_versions]
-    most_active_data_append_unique(most_active, json_results, top_extension_versions, 'namespace')
-
-    most_active[top_downloads][year_month] = json_results[top_downloads]
-    most_active_data_append_unique(most_active, json_results, top_downloads, 'extensionIdentifier')
-
-def get_most_active_data(starting_year, starting_month):
+def extract_most_active_data(reports):
     most_active = {
         'dates': [],
         'topMostActivePublishingUsers': {
-            'unique': []
+            'unique': {},
+            'records': []
         },
         'topNamespaceExtensions': {
-            'unique': []
+            'unique': {},
+            'records': []
         },
         'topNamespaceExtensionVersions': {
-            'unique': []
+            'unique': {},
+            'records': []
         },
         'topMostDownloadedExtensions': {
-            'unique': []
+            'unique': {},
+            'records': []
         }
     }
 
-    today = date.today()
-    start_date = date(starting_year, starting_month, 1)
-    while start_date.year < today.year or (start_date.year == today.year and start_date.month < today.month):
-        url = f'{ADMIN_REPORTS_ENDPOINT}report?year={start_date.year}&month={start_date.month}&token={OPEN_VSX_ACCESS_TOKEN}'
-        response = requests.get(url)
-        if response.status_code == 200:
-            try:
-                extract_most_active_data_from_json(most_active, response.json(), start_date.year, start_date.month)                
-            except Exception as e:
-                print(f"Error {e} decoding JSON results for {url}")
-        else:
-            print("%s error processing results for %s" % (response.status_code, url))
-        start_date = start_date + relativedelta(months=1)
+    for year, month, json_results in reports:
+        try:
+            extract_most_active_data_from_json(most_active, json_results, year, month)
+        except Exception as e:
+            print(f"Error {e} reading results for {year}-{month}")
     
     return process_most_active_data(most_active)
 
+def get_most_active_data(starting_year, starting_month):
+    return extract_most_active_data(get_reports(starting_year, starting_month))
+
+def get_all_data(starting_year, starting_month):
+    """Returns the publishing data and most active data, fetching each month once."""
+    reports = get_reports(starting_year, starting_month)
+    return extract_publishing_data(reports), extract_most_active_data(reports)
+
+class AdminReports:
+    """
+    Lazily evaluated admin reports for every completed month since a starting month.
+    Months are only fetched when a view or report[year, month] needs them, and are
+    memoized in-process as well as on disk by get_report(). Views are computed once
+    and returned as copies, so callers can modify them freely.
+
+    Months without a generated report are left out, unless schedule is set: then
+    they are scheduled and the first view waits for them, for up to
+    SCHEDULE_TIMEOUT_SECONDS.
+    """
+    def __init__(self, starting_year, starting_month, max_workers=MAX_WORKERS, schedule=False):
+        self.starting_year = starting_year
+        self.starting_month = starting_month
+        self.max_workers = max_workers
+        self.schedule = schedule
+        self.lock = threading.Lock()
+        self._reports = {}
+        self._views = {}
+
+    @property
+    def months(self):
+        return get_months(self.starting_year, self.starting_month)
+
+    def __getitem__(self, year_month):
+        """Returns the report of one (year, month), or None if there is none yet."""
+        with self.lock:
+            if year_month in self._reports:
+                return self._reports[year_month]
+        report = get_report(*year_month)
+        if report is not None:
+            with self.lock:
+                self._reports[year_month] = report
+        return report
+
+    def load(self):
+        """
+        Fetches all months not memoized yet concurrently, scheduling the ones not generated
+        yet, and returns (year, month, report) in month order.
+        """
+        months = self.months
+        missing = [year_month for year_month in months if year_month not in self._reports]
+        if len(missing) > 0:
+            fetch_months(missing, self.__getitem__, self.max_workers, self.schedule)
+        return [(year, month, self._reports[(year, month)]) for year, month in months
+                if (year, month) in self._reports]
+
+    def _get_view(self, name, build):
+        # Keyed on the months that loaded, so a view is rebuilt once another month
+        # completes or a month that failed to load is fetched
+        reports = self.load()
+        key = (name, tuple((year, month) for year, month, report in reports))
+        if key not in self._views:
+            self._views[key] = build(reports)
+        return self._views[key]
+
+    @property
+    def totals(self):
+        """Extensions, downloads, publishers etc. per month, see HEADERS, plus a 'date' column."""
+        def build(reports):
+            df = extract_publishing_data(reports)
+            df['date'] = ['%s/%s' % (month, str(year)[2:]) for year, month in zip(df['year'], df['month'])]
+            return df
+        return self._get_view('totals', build).copy()
+
+    @property
+    def most_active(self):
+        """The DataFrames of get_most_active_data() keyed on category."""
+        views = self._get_view('most_active', extract_most_active_data)
+        return {key: df.copy() for key, df in views.items()}
+
+    @property
+    def per_publisher(self):
+        """Extension versions published per month by the most active users."""
+        return self._get_view('most_active', extract_most_active_data)['topMostActivePublishingUsers'].copy()
+
+    @property
+    def per_namespace(self):
+        """Extensions per month in the namespaces with the most extensions."""
+        return self._get_view('most_active', extract_most_active_data)['topNamespaceExtensions'].copy()
+
+    @property
+    def per_namespace_versions(self):
+        """Extension versions per month in the namespaces with the most extension versions."""
+        return self._get_view('most_active', extract_most_active_data)['topNamespaceExtensionVersions'].copy()
+
+    @property
+    def per_extension(self):
+        """Downloads per month of the most downloaded extensions."""
+        return self._get_view('most_active', extract_most_active_data)['topMostDownloadedExtensions'].copy()
+
+_admin_reports = {}
+
+def get_admin_reports(starting_year, starting_month, schedule=False):
+    """
+    Returns the AdminReports since a starting month. The same object is returned for
+    the same starting month, so re-running a notebook cell reuses what it loaded.
+    """
+    key = (starting_year, starting_month, schedule)
+    if key not in _admin_reports:
+        _admin_reports[key] = AdminReports(starting_year, starting_month, schedule=schedule)
+    return _admin_reports[key]
+
 if __name__ == '__main__':
 
     most_active_dfs = get_most_active_data(2021, 11)
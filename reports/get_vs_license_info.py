@@ -2,83 +2,107 @@
 Script to retrieve license information for vs code extensions
 """
 
-import requests
 import json
-import re
+from concurrent.futures import as_completed
+import columnar_io
+import http_client
+import license_classifier
+import record_io
 
+VS_CODE_EXTENSIONS_NDJSON_FILE_NAME = 'vs_code_extensions.ndjson'
 VS_CODE_EXTENSIONS_FILE_NAME = 'vs_code_extensions.json'
 SLEEP_SECONDS = 1
 LICENSE_FILE_NAME = 'vs_code_licenses.json'
+LICENSE_PARQUET_FILE_NAME = columnar_io.VS_CODE_LICENSES_FILE_NAME
+# License files are downloaded by MAX_WORKERS threads sharing REQUESTS_PER_SECOND.
+# Results are written out every CHECKPOINT_INTERVAL licenses.
+MAX_WORKERS = 8
+REQUESTS_PER_SECOND = 20
+CHECKPOINT_INTERVAL = 500
 
-def get_license(extension):
+def get_license(extension, rate_limiter=None):
     # https://marketplace.visualstudio.com/items/ms-python.vscode-pylance/license
     license = "None"
     publisher = extension['publisher']['publisherName']
     extension_name = extension['extensionName']
-    url = f"https://{publisher}.gallery.vsassets.io/_apis/public/gallery/publisher/{publisher}/extension/{extension_name}/latest/assetbyname/Microsoft.VisualStudio.Services.Content.License"
-    response = requests.get(url)
+    version = get_version(extension)
+    # The license of a published version never changes, so it can be cached for good
+    url = f"https://{publisher}.gallery.vsassets.io/_apis/public/gallery/publisher/{publisher}/extension/{extension_name}/{version}/assetbyname/Microsoft.VisualStudio.Services.Content.License"
+    response = http_client.get(url, cached=True, ttl=http_client.FOREVER, rate_limiter=rate_limiter)
     if response.status_code == 200:
-        license_content = response.text
-        if 'MICROSOFT SOFTWARE LICENSE TERMS' in license_content:
-            license = 'Microsoft Commercial'
-        elif 'MIT ' in license_content or 'MIT\n' in license_content:
-            license = "MIT"
-        elif 'Apache' in license_content:
-            license = 'Apache'
-        elif 'Eclipse Public License' in license_content:
-            license = 'EPL'
-        elif 'BSD ' in license_content or 'BSD\n' in license_content:
-            license = 'BSD'
-        elif 'MPL ' in license_content or 'Mozilla' in license_content:
-            license = 'MPL'
-        elif 'GNU LESSER' in license_content or 'GNU Lesser' in license_content:
-            license = 'LGPL'
-        elif 'GNU GENERAL' in license_content or 'GNU General' in license_content:
-            license = 'GPL'
-        elif 'GNU AFFERO' in license_content or 'GNU Affero' in license_content:
-            license = 'AGPL'
-        elif 'GPL ' in license_content or 'GPL\n' in license_content:
-            license = 'GPL'
-        elif 'ISC ' in license_content or 'ISC\n' in license_content:
-            license = 'ISC'
-        elif 'Creative Commons' in license_content or 'creativecommons.org' in license_content:
-            license = 'Creative Commons'
-        else:
-            clean_text = re.sub(r'\s+', ' ', license_content)
-            if len(clean_text) > 0:
-                license = f'Other - {clean_text[:80]}'
-            else:
-                license = 'None'
+        license = license_classifier.classify(response.text)
+    elif response.status_code != 404:
+        # Don't record a transient failure as "None", retry on the next run instead
+        response.raise_for_status()
     return license
 
-extensions_file = open(VS_CODE_EXTENSIONS_FILE_NAME, 'r')
-extensions = json.load(extensions_file)
-extensions_file.close()
-try:
-    licenses_file = open(LICENSE_FILE_NAME, 'r')
-    licenses = json.load(licenses_file)
-    licenses_file.close()
-except Exception as e:
-    licenses = {}
-try:
-    count = 1
-    processed = 1
+def get_extension_id(extension):
+    return f"{extension['publisher']['publisherName']}.{extension['extensionName']}"
+
+def get_version(extension):
+    return extension['versions'][0]['version']
+
+def load_licenses():
+    try:
+        with open(LICENSE_FILE_NAME, 'r') as licenses_file:
+            return json.load(licenses_file)
+    except Exception:
+        return {}
+
+def write_licenses(licenses):
+    # Write to a temporary file and rename it, so a killed run never leaves a truncated file
+    record_io.write_json_atomic(LICENSE_FILE_NAME, licenses, indent=4)
+
+def update_licenses(extensions, licenses, max_workers=MAX_WORKERS):
+    """
+    Downloads the license of every extension whose latest version has no known
+    license using up to max_workers concurrent requests, writing licenses out every
+    CHECKPOINT_INTERVAL results. Licenses of extensions that are no longer in
+    extensions are removed.
+    """
+    count = 0
+    to_fetch = []
+    extension_ids = set()
     for extension in extensions:
-        extension_id = f"{extension['publisher']['publisherName']}.{extension['extensionName']}"
+        extension_id = get_extension_id(extension)
+        extension_ids.add(extension_id)
         license = licenses.get(extension_id)
-        if license is None or license['license'] is None:
-            license = get_license(extension)
+        if license is None or license.get('version') != get_version(extension):
+            to_fetch.append(extension)
+        count += 1
+    removed_ids = [extension_id for extension_id in licenses if extension_id not in extension_ids]
+    for extension_id in removed_ids:
+        del licenses[extension_id]
+    print(f"Retrieving {len(to_fetch)} licenses, removed {len(removed_ids)}. {count} total extensions.")
+
+    processed = 1
+    rate_limiter = http_client.RateLimiter(REQUESTS_PER_SECOND)
+    with http_client.request_executor(max_workers) as executor:
+        futures = {executor.submit(get_license, extension, rate_limiter): extension for extension in to_fetch}
+        for future in as_completed(futures):
+            extension = futures[future]
+            extension_id = get_extension_id(extension)
+            try:
+                license = future.result()
+            except Exception as e:
+                print(f"{extension_id}: {e}")
+                continue
             licenses[extension_id] = {
                 "license": license,
-                "version": extension['versions'][0]['version']
+                "version": get_version(extension)
             }
             print(f"{extension_id}: {license} - Processed {processed} extensions. {count} total extensions.")
+            if processed % CHECKPOINT_INTERVAL == 0:
+                write_licenses(licenses)
             processed += 1
-        count += 1
-except Exception as e:
-    print(e)
-finally:
-    # Output JSON File
-    output_file = open(LICENSE_FILE_NAME, 'w')
-    output_file.write(json.dumps(licenses, indent=4))
-    output_file.close()
\ No newline at end of file
+
+if __name__ == '__main__':
+    licenses = load_licenses()
+    try:
+        update_licenses(record_io.read_records(VS_CODE_EXTENSIONS_NDJSON_FILE_NAME, VS_CODE_EXTENSIONS_FILE_NAME), licenses)
+    except Exception as e:
+        print(e)
+    finally:
+        # Output JSON and Parquet Files
+        write_licenses(licenses)
+        columnar_io.write_parquet(licenses.items(), LICENSE_PARQUET_FILE_NAME, columnar_io.VS_CODE_LICENSES_FIELDS)
@@ -0,0 +1,343 @@
+"""
+Shared HTTP client used by the report scripts. All requests go through one pooled
+requests.Session so connections are kept alive and responses can be gzip encoded.
+Requests that fail with a connection error, a 429 or a 5xx are retried with
+exponential backoff, honouring the Retry-After header when the server sends one.
+The number of concurrent requests to any one host, or to any one of HOST_GROUPS, is
+capped.
+
+GET requests made with cached=True are stored in a local SQLite response cache.
+Entries younger than their TTL are served without a request. Older entries are
+revalidated with If-None-Match / If-Modified-Since when the server sent an ETag or
+Last-Modified header, so an unchanged resource costs a 304 instead of a download.
+"""
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+POOL_SIZE = 32
+DEFAULT_TIMEOUT = 60
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_MAX_SECONDS = 60
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+DEFAULT_HOST_LIMIT = 8
+# Domains whose subdomains share one concurrency cap, e.g. license downloads from
+# {publisher}.gallery.vsassets.io, which would otherwise get a cap per publisher
+HOST_GROUPS = ['gallery.vsassets.io']
+
+CACHE_FILE_NAME = 'http_cache.sqlite'
+CACHE_TTL_SECONDS = 24 * 60 * 60
+# Entries not used for this long are dropped, as is the least recently used
+# data once the cache grows past CACHE_MAX_BYTES.
+CACHE_MAX_AGE_SECONDS = 90 * 24 * 60 * 60
+CACHE_MAX_BYTES = 1024 * 1024 * 1024
+CACHE_EVICT_INTERVAL = 500
+# TTL for resources that never change once they exist
+FOREVER = float('inf')
+# Headers describing the transfer rather than the cached (decoded) body
+_UNCACHED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection'}
+
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+_session.mount('https://', _adapter)
+_session.mount('http://', _adapter)
+
+_host_limits = {}
+_host_semaphores = {}
+_host_lock = threading.Lock()
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1/rate seconds apart, across threads."""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def record(self, status_code):
+        pass
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by several threads. Whenever a 429 is recorded the refill
+    rate is halved and the bucket emptied, and each successful response raises the
+    rate again by a small step, up to max_rate.
+    """
+    def __init__(self, rate, max_rate=None, min_rate=0.05, burst=1, increase=0.01):
+        self.rate = rate
+        self.max_rate = rate if max_rate is None else max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.increase = increase
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def record(self, status_code):
+        with self.lock:
+            self._refill()
+            if status_code == 429:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.tokens = 0
+                print(f'{datetime.now()}: rate limited, slowing down to {self.rate:.2f} requests/s')
+            elif status_code < 400:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+def get_host_group(host):
+    """Returns the key the concurrency cap of host is kept under, its HOST_GROUPS domain or the host itself."""
+    for domain in HOST_GROUPS:
+        if host == domain or host.endswith('.' + domain):
+            return domain
+    return host
+
+@contextmanager
+def request_executor(max_workers):
+    """
+    A ThreadPoolExecutor for making requests concurrently. Leaving the with block on
+    Ctrl-C, an error or a closed generator cancels the queued requests, so only the
+    running ones are waited for.
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        yield executor
+    except BaseException:
+        executor.shutdown(cancel_futures=True)
+        raise
+    executor.shutdown()
+
+def set_host_limit(host, limit):
+    """Sets the maximum number of concurrent requests to host, or to its HOST_GROUPS domain."""
+    host = get_host_group(host)
+    with _host_lock:
+        _host_limits[host] = limit
+        _host_semaphores[host] = threading.BoundedSemaphore(limit)
+
+def _get_host_semaphore(url):
+    host = get_host_group(urlparse(url).hostname)
+    with _host_lock:
+        semaphore = _host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(_host_limits.get(host, DEFAULT_HOST_LIMIT))
+            _host_semaphores[host] = semaphore
+    return semaphore
+
+def get_retry_after(response):
+    """Returns the Retry-After delay of a response in seconds, or None."""
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_date = parsedate_to_datetime(value)
+        return max(0.0, (retry_date - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def get_backoff(attempt, response=None):
+    """Returns how long to wait before retry number attempt (starting at 0)."""
+    if response is not None:
+        retry_after = get_retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, BACKOFF_MAX_SECONDS)
+    delay = min(BACKOFF_BASE_SECONDS * (2 ** attempt), BACKOFF_MAX_SECONDS)
+    return delay + random.uniform(0, delay / 2)
+
+def request(method, url, max_retries=MAX_RETRIES, rate_limiter=None, **kwargs):
+    """
+    Sends a request through the shared session. Returns the last response once it
+    succeeds, fails with a non-retryable status or runs out of retries. Connection
+    errors are raised once retries are exhausted.
+    """
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    semaphore = _get_host_semaphore(url)
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.wait()
+        try:
+            with semaphore:
+                response = _session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt >= max_retries:
+                raise
+            delay = get_backoff(attempt)
+            print(f'{datetime.now()}: {e}, retrying in {delay:.1f}s')
+        else:
+            if rate_limiter is not None:
+                rate_limiter.record(response.status_code)
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+                return response
+            delay = get_backoff(attempt, response)
+            print(f'{datetime.now()}: HTTP {response.status_code} for {url}, retrying in {delay:.1f}s')
+        time.sleep(delay)
+        attempt += 1
+
+class ResponseCache:
+    """SQLite backed store of successful GET responses with TTL and size-based eviction."""
+    def __init__(self, filename=CACHE_FILE_NAME, max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE_SECONDS):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.stores_since_evict = 0
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            url TEXT,
+            headers TEXT,
+            body BLOB,
+            etag TEXT,
+            last_modified TEXT,
+            stored_at REAL,
+            accessed_at REAL,
+            size INTEGER)''')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self.connection.commit()
+
+    @staticmethod
+    def get_key(url):
+        # URLs can carry access tokens, only store their digest as the key
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def lookup(self, url):
+        key = self.get_key(url)
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT headers, body, etag, last_modified, stored_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (time.time(), key))
+            self.connection.commit()
+        headers, body, etag, last_modified, stored_at = row
+        return {'headers': json.loads(headers), 'body': body, 'etag': etag,
+                'last_modified': last_modified, 'stored_at': stored_at}
+
+    def store(self, url, response):
+        headers = {name: value for name, value in response.headers.items() if name.lower() not in _UNCACHED_HEADERS}
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.get_key(url), url.split('?')[0], json.dumps(headers), response.content,
+                 response.headers.get('ETag'), response.headers.get('Last-Modified'), now, now, len(response.content)))
+            self.connection.commit()
+            self.stores_since_evict += 1
+            if self.stores_since_evict >= CACHE_EVICT_INTERVAL:
+                self._evict()
+
+    def refresh(self, url):
+        """Marks an entry as fresh again after the server answered 304 Not Modified."""
+        now = time.time()
+        with self.lock:
+            self.connection.execute('UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?',
+                                    (now, now, self.get_key(url)))
+            self.connection.commit()
+
+    def evict(self):
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        self.stores_since_evict = 0
+        self.connection.execute('DELETE FROM responses WHERE accessed_at < ?', (time.time() - self.max_age,))
+        total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total > self.max_bytes:
+            # Drop least recently used entries until 10% below the limit
+            excess = total - int(self.max_bytes * 0.9)
+            freed = 0
+            keys = []
+            for key, size in self.connection.execute('SELECT key, size FROM responses ORDER BY accessed_at'):
+                if freed >= excess:
+                    break
+                keys.append((key,))
+                freed += size
+            self.connection.executemany('DELETE FROM responses WHERE key = ?', keys)
+        self.connection.commit()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Returns the shared response cache, opening CACHE_FILE_NAME on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+    return _cache
+
+def _cached_response(url, entry):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers = CaseInsensitiveDict(entry['headers'])
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response._content = entry['body']
+    return response
+
+def get(url, cached=False, ttl=CACHE_TTL_SECONDS, **kwargs):
+    """
+    Sends a GET request. With cached=True, a cached response younger than ttl seconds
+    is returned without contacting the server, and an older one is revalidated.
+    """
+    if not cached:
+        return request('GET', url, **kwargs)
+
+    cache = get_cache()
+    entry = cache.lookup(url)
+    if entry is not None and time.time() - entry['stored_at'] < ttl:
+        return _cached_response(url, entry)
+
+    if entry is not None and (entry['etag'] or entry['last_modified']):
+        headers = dict(kwargs.get('headers') or {})
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        kwargs['headers'] = headers
+
+    response = request('GET', url, **kwargs)
+    if response.status_code == 304 and entry is not None:
+        cache.refresh(url)
+        return _cached_response(url, entry)
+    if response.status_code == 200:
+        cache.store(url, response)
+    return response
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
@@ -0,0 +1,139 @@
+"""
+Classifies license texts by the license family they belong to. The signatures are
+checked in SIGNATURES order with plain substring tests, the first one found wins.
+For texts that match no signature only the start of the text is normalized for the
+description, rather than the whole document.
+
+Run this module to benchmark classify() against the original chain of substring
+checks, either on a directory of license text files or on built-in samples.
+"""
+import argparse
+import os
+import re
+import time
+
+# (license, substrings) in precedence order
+SIGNATURES = [
+    ('Microsoft Commercial', ['MICROSOFT SOFTWARE LICENSE TERMS']),
+    ('MIT', ['MIT ', 'MIT\n']),
+    ('Apache', ['Apache']),
+    ('EPL', ['Eclipse Public License']),
+    ('BSD', ['BSD ', 'BSD\n']),
+    ('MPL', ['MPL ', 'Mozilla']),
+    ('LGPL', ['GNU LESSER', 'GNU Lesser']),
+    ('GPL', ['GNU GENERAL', 'GNU General']),
+    ('AGPL', ['GNU AFFERO', 'GNU Affero']),
+    ('GPL', ['GPL ', 'GPL\n']),
+    ('ISC', ['ISC ', 'ISC\n']),
+    ('Creative Commons', ['Creative Commons', 'creativecommons.org']),
+]
+OTHER_PREFIX_LENGTH = 80
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+def get_other_description(text):
+    """
+    Returns the first OTHER_PREFIX_LENGTH characters of text with runs of whitespace
+    collapsed to one space, only normalizing as much of the text as needed.
+    """
+    length = OTHER_PREFIX_LENGTH * 2
+    while True:
+        clean_text = WHITESPACE_PATTERN.sub(' ', text[:length])
+        if len(clean_text) > OTHER_PREFIX_LENGTH or length >= len(text):
+            return clean_text[:OTHER_PREFIX_LENGTH]
+        length *= 2
+
+def classify(text):
+    """Returns the license family of a license text, see get_vs_license_info.get_license."""
+    for license, substrings in SIGNATURES:
+        for substring in substrings:
+            if substring in text:
+                return license
+    if len(text) > 0:
+        return f'Other - {get_other_description(text)}'
+    return 'None'
+
+def classify_with_substrings(text):
+    """The original if/elif chain, kept as the reference for benchmark()."""
+    if 'MICROSOFT SOFTWARE LICENSE TERMS' in text:
+        return 'Microsoft Commercial'
+    elif 'MIT ' in text or 'MIT\n' in text:
+        return "MIT"
+    elif 'Apache' in text:
+        return 'Apache'
+    elif 'Eclipse Public License' in text:
+        return 'EPL'
+    elif 'BSD ' in text or 'BSD\n' in text:
+        return 'BSD'
+    elif 'MPL ' in text or 'Mozilla' in text:
+        return 'MPL'
+    elif 'GNU LESSER' in text or 'GNU Lesser' in text:
+        return 'LGPL'
+    elif 'GNU GENERAL' in text or 'GNU General' in text:
+        return 'GPL'
+    elif 'GNU AFFERO' in text or 'GNU Affero' in text:
+        return 'AGPL'
+    elif 'GPL ' in text or 'GPL\n' in text:
+        return 'GPL'
+    elif 'ISC ' in text or 'ISC\n' in text:
+        return 'ISC'
+    elif 'Creative Commons' in text or 'creativecommons.org' in text:
+        return 'Creative Commons'
+    else:
+        clean_text = re.sub(r'\s+', ' ', text)
+        if len(clean_text) > 0:
+            return f'Other - {clean_text[:80]}'
+        else:
+            return 'None'
+
+SAMPLE_FILLER = ('THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR\n'
+                 'IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,\n'
+                 'FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.\n\n')
+SAMPLE_LICENSES = [
+    'MICROSOFT SOFTWARE LICENSE TERMS\n\nMICROSOFT VISUAL STUDIO CODE EXTENSION\n\n' + SAMPLE_FILLER * 40,
+    'MIT License\n\nCopyright (c) Example\n\n' + SAMPLE_FILLER * 3,
+    SAMPLE_FILLER * 2 + 'Licensed under the Apache License, Version 2.0\n' + SAMPLE_FILLER * 30,
+    'Eclipse Public License - v 2.0\n\n' + SAMPLE_FILLER * 30,
+    'BSD 3-Clause License\n\n' + SAMPLE_FILLER * 4,
+    'Mozilla Public License Version 2.0\n' + SAMPLE_FILLER * 30,
+    'GNU LESSER GENERAL PUBLIC LICENSE\nVersion 3, 29 June 2007\n' + SAMPLE_FILLER * 20,
+    'GNU GENERAL PUBLIC LICENSE\nVersion 3, 29 June 2007\n' + SAMPLE_FILLER * 60,
+    'ISC License\n\n' + SAMPLE_FILLER * 2,
+    'Attribution 4.0 International, see creativecommons.org\n' + SAMPLE_FILLER * 20,
+    'Copyright (c) Example Corp.\nAll rights reserved.\n\n' + SAMPLE_FILLER * 10,
+    '',
+]
+
+def load_corpus(directory):
+    texts = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                texts.append(f.read())
+    return texts
+
+def benchmark(texts, repeat=20):
+    """Times classify() against classify_with_substrings() and checks they agree."""
+    for text in texts:
+        expected = classify_with_substrings(text)
+        actual = classify(text)
+        if actual != expected:
+            print(f'Mismatch: {actual!r} != {expected!r} for {text[:60]!r}')
+    total_bytes = sum(len(text) for text in texts) * repeat
+    for name, function in [('substring chain', classify_with_substrings), ('signature table', classify)]:
+        start = time.perf_counter()
+        for i in range(repeat):
+            for text in texts:
+                function(text)
+        elapsed = time.perf_counter() - start
+        print(f'{name}: {elapsed:.3f}s for {len(texts) * repeat} documents, {total_bytes / elapsed / 1e6:.1f} MB/s')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark license classification.')
+    parser.add_argument('directory', nargs='?',
+                        help='directory of license text files, defaults to built-in samples')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.directory) if args.directory else SAMPLE_LICENSES * 50
+    benchmark(corpus, args.repeat)
@@ -0,0 +1,202 @@
+"""
+Shared client for the VS Code Marketplace extensionquery API, used by
+get_all_vs_marketplace_extensions.py and get_vs_marketplace_data.py. Note, this relies
+on interfaces that are not fully documented and are subject to change.
+
+iter_pages() is a generator that yields each page of results as soon as it arrives,
+so callers can process one page while the next is requested. The flags select which
+parts of each extension are returned, see the FLAG_* constants.
+"""
+import json
+import http_client
+
+MS_API_URL = 'https://marketplace.visualstudio.com/_apis/public/gallery/extensionquery'
+MS_HEADERS = {
+    'content-type': 'application/json',
+    'accept': 'application/json;api-version=3.0-preview.1',
+    'accept-encoding': 'gzip'
+}
+ASSET_TYPES = [
+    "Microsoft.VisualStudio.Services.Icons.Default",
+    "Microsoft.VisualStudio.Services.Icons.Branding",
+    "Microsoft.VisualStudio.Services.Icons.Small"
+]
+
+# Query flags, combined with |
+FLAG_INCLUDE_VERSIONS = 0x1
+FLAG_INCLUDE_FILES = 0x2
+FLAG_INCLUDE_CATEGORY_AND_TAGS = 0x4
+FLAG_INCLUDE_VERSION_PROPERTIES = 0x10
+FLAG_EXCLUDE_NON_VALIDATED = 0x20
+FLAG_INCLUDE_INSTALLATION_TARGETS = 0x40
+FLAG_INCLUDE_ASSET_URI = 0x80
+FLAG_INCLUDE_STATISTICS = 0x100
+FLAG_INCLUDE_LATEST_VERSION_ONLY = 0x200
+# 914: latest version with its properties, files, asset URI and statistics
+DEFAULT_FLAGS = (FLAG_INCLUDE_FILES | FLAG_INCLUDE_VERSION_PROPERTIES | FLAG_INCLUDE_ASSET_URI
+                 | FLAG_INCLUDE_STATISTICS | FLAG_INCLUDE_LATEST_VERSION_ONLY)
+# 870: latest version with files, categories, installation targets and statistics, validated only
+SUMMARY_FLAGS = (FLAG_INCLUDE_FILES | FLAG_INCLUDE_CATEGORY_AND_TAGS | FLAG_EXCLUDE_NON_VALIDATED
+                 | FLAG_INCLUDE_INSTALLATION_TARGETS | FLAG_INCLUDE_STATISTICS | FLAG_INCLUDE_LATEST_VERSION_ONLY)
+
+# Looks like 1000 is the max page size
+PAGE_SIZE = 1000
+SORT_BY_INSTALL_COUNT = 4
+SORT_DESCENDING = 2
+# Request rate used when the caller doesn't pass a rate limiter. It is halved on
+# every 429 and slowly recovers up to MAX_REQUESTS_PER_SECOND.
+REQUESTS_PER_SECOND = 0.5
+MAX_REQUESTS_PER_SECOND = 2
+
+# All VS Code extensions
+VS_CODE_CRITERIA = [
+    {
+        "filterType": 8,
+        "value": "Microsoft.VisualStudio.Code"
+    },
+    {
+        "filterType": 10,
+        "value": "target:\"Microsoft.VisualStudio.Code\" "
+    },
+    {
+        "filterType": 12,
+        "value": "37888"
+    }
+]
+
+def category_criteria(category):
+    """Returns VS_CODE_CRITERIA narrowed to one category."""
+    return VS_CODE_CRITERIA + [
+        {
+            "filterType": 5,
+            "value": category
+        }
+    ]
+
+def build_query(criteria, page_number, flags=DEFAULT_FLAGS, page_size=PAGE_SIZE):
+    return {
+        "assetTypes": ASSET_TYPES,
+        "filters": [
+            {
+                "criteria": criteria,
+                "direction": SORT_DESCENDING,
+                "pageSize": page_size,
+                "pageNumber": page_number,
+                "sortBy": SORT_BY_INSTALL_COUNT,
+                "sortOrder": 0,
+                "pagingToken": None
+            }
+        ],
+        "flags": flags
+    }
+
+def get_total(result):
+    """Returns the total number of matching extensions reported with a page, or None."""
+    try:
+        return result['resultMetadata'][0]['metadataItems'][0]['count']
+    except (KeyError, IndexError):
+        return None
+
+def query_page(criteria, page_number, flags=DEFAULT_FLAGS, page_size=PAGE_SIZE, rate_limiter=None):
+    """Returns the extensions on one page of results and the total number of matches, if reported."""
+    payload = build_query(criteria, page_number, flags, page_size)
+    response = http_client.post(MS_API_URL, headers=MS_HEADERS, data=json.dumps(payload), rate_limiter=rate_limiter)
+    response.raise_for_status()
+    data = response.json()
+
+    # Check if 'results' exists and has data
+    if 'results' not in data or not data['results']:
+        return [], None
+    result = data['results'][0]
+    return result.get('extensions', []), get_total(result)
+
+def iter_pages(criteria=VS_CODE_CRITERIA, flags=DEFAULT_FLAGS, start_page=1, page_size=PAGE_SIZE, rate_limiter=None):
+    """
+    Yields (page_number, extensions, total) for every page of results from start_page
+    on, stopping at the first empty page or once all total results have been paged
+    through. HTTP errors are raised, after http_client's retries.
+    """
+    if rate_limiter is None:
+        rate_limiter = http_client.AdaptiveRateLimiter(REQUESTS_PER_SECOND, max_rate=MAX_REQUESTS_PER_SECOND)
+    page_number = start_page
+    while True:
+        extensions, total = query_page(criteria, page_number, flags, page_size, rate_limiter)
+        if not extensions:
+            return
+        yield page_number, extensions, total
+        if total is not None and page_number * page_size >= total:
+            return
+        page_number += 1
+
+def iter_extensions(criteria=VS_CODE_CRITERIA, flags=DEFAULT_FLAGS, rate_limiter=None):
+    """Yields every extension matching criteria, page by page as results arrive."""
+    for page_number, extensions, total in iter_pages(criteria, flags, rate_limiter=rate_limiter):
+        yield from extensions
+
+SOURCE_LINK_PROPERTY = 'Microsoft.VisualStudio.Services.Links.Source'
+PRICING_PROPERTY = 'Microsoft.VisualStudio.Services.Content.Pricing'
+
+class MarketplaceExtension:
+    """
+    The commonly used fields of one Marketplace extension, extracted from its query
+    result once. The properties of the latest version and the statistics are indexed
+    by key, so looking one up doesn't scan the raw lists again.
+    """
+    __slots__ = ('extension_id', 'publisher_name', 'extension_name', 'display_name', 'version',
+                 'last_updated', 'version_last_updated', 'published_date', 'properties', 'statistics')
+
+    def __init__(self, extension_id, publisher_name, extension_name, display_name, version,
+                 last_updated, version_last_updated, published_date, properties, statistics):
+        self.extension_id = extension_id
+        self.publisher_name = publisher_name
+        self.extension_name = extension_name
+        self.display_name = display_name
+        self.version = version
+        self.last_updated = last_updated
+        self.version_last_updated = version_last_updated
+        self.published_date = published_date
+        self.properties = properties
+        self.statistics = statistics
+
+    @classmethod
+    def from_json(cls, ext):
+        latest_version = ext['versions'][0]
+        # The first occurrence of a key wins, as with the list scans this replaces
+        properties = {}
+        for prop in latest_version.get('properties', []):
+            properties.setdefault(prop['key'], prop.get('value'))
+        statistics = {}
+        for stat in ext.get('statistics', []):
+            statistics.setdefault(stat.get('statisticName'), stat.get('value', 0))
+        return cls(ext.get('extensionId'), ext['publisher']['publisherName'], ext['extensionName'],
+                   ext.get('displayName'), latest_version['version'], ext.get('lastUpdated'),
+                   latest_version.get('lastUpdated'), ext.get('publishedDate'), properties, statistics)
+
+    @property
+    def vscode_id(self):
+        return f"{self.publisher_name}.{self.extension_name}"
+
+    @property
+    def repository(self):
+        return self.properties.get(SOURCE_LINK_PROPERTY)
+
+    @property
+    def pricing(self):
+        return self.properties.get(PRICING_PROPERTY)
+
+    @property
+    def installs(self):
+        return self.statistics.get('install', 0)
+
+def iter_records(extensions):
+    """Yields a MarketplaceExtension for each raw query result."""
+    for ext in extensions:
+        yield MarketplaceExtension.from_json(ext)
+
+def get_ms_info(ext):
+    """Returns the CSV fields of a raw query result or a MarketplaceExtension."""
+    if not isinstance(ext, MarketplaceExtension):
+        ext = MarketplaceExtension.from_json(ext)
+    display_name = ext.display_name.replace(',', ' ')
+    return (ext.extension_name, ext.publisher_name, display_name, ext.version, ext.version_last_updated,
+            ext.repository, ext.pricing)
@@ -0,0 +1,175 @@
+"""
+Helpers for streaming crawl results to disk as NDJSON, one JSON record per line.
+Records are written as they arrive so memory use stays flat and a crawl that dies
+part way keeps everything written so far. compact_to_json() turns an NDJSON file
+into the indented JSON array format the scripts used to write, and iter_json_array()
+reads such a file back one record at a time.
+
+Long crawls save a Checkpoint alongside their .partial NDJSON file so a restarted
+run can truncate the file to the last checkpoint and carry on from there.
+"""
+import json
+import os
+import textwrap
+
+# Characters read at a time when streaming a JSON array
+JSON_CHUNK_SIZE = 1024 * 1024
+
+class NdjsonWriter:
+    """Appends records to an NDJSON file, one line per record."""
+    def __init__(self, filename, append=False, count=0):
+        self.filename = filename
+        self.file = open(filename, 'a' if append else 'w', encoding='utf-8')
+        # Records in the file, including ones written before an append
+        self.count = count
+
+    def write(self, record):
+        self.file.write(json.dumps(record))
+        self.file.write('\n')
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def read_ndjson(filename):
+    """Yields the records of an NDJSON file. A truncated last line is ignored."""
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f'Skipping incomplete record in {filename}')
+
+def iter_json_array(filename, chunk_size=JSON_CHUNK_SIZE):
+    """
+    Yields the elements of the JSON array in filename one at a time, so only the
+    current element and one chunk of text are held in memory rather than the whole
+    file. Raises json.JSONDecodeError if the file isn't a JSON array.
+    """
+    decoder = json.JSONDecoder()
+    with open(filename, 'r', encoding='utf-8') as f:
+        buffer = ''
+        position = 0
+        eof = False
+        started = False
+        while True:
+            # Skip whitespace and separators, reading more text as needed
+            while position < len(buffer) and (buffer[position].isspace() or (started and buffer[position] == ',')):
+                position += 1
+            if position == len(buffer):
+                if eof:
+                    raise json.JSONDecodeError('Unterminated array', buffer, position)
+                buffer = f.read(chunk_size)
+                position = 0
+                eof = len(buffer) < chunk_size
+                continue
+            if not started:
+                if buffer[position] != '[':
+                    raise json.JSONDecodeError('Expecting JSON array', buffer, position)
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+                complete = end < len(buffer) or eof
+                # A number cut off after '.' or an exponent marker still decodes, as the
+                # number before it, so look at what follows it
+                if complete and not eof and type(element) in (int, float) and buffer[end] in '.eE':
+                    complete = False
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                # The element continues past the buffer, read at least as much again
+                more = f.read(max(chunk_size, len(buffer) - position))
+                eof = len(more) == 0
+                buffer = buffer[position:] + more
+                position = 0
+                continue
+            yield element
+            position = end
+
+def read_records(ndjson_filename, json_filename):
+    """
+    Yields records from ndjson_filename if it exists, otherwise streams them from the
+    JSON array in json_filename.
+    """
+    if os.path.exists(ndjson_filename):
+        yield from read_ndjson(ndjson_filename)
+    else:
+        yield from iter_json_array(json_filename)
+
+def compact_to_json(ndjson_filename, json_filename, indent=4):
+    """
+    Writes the records of an NDJSON file as one JSON array, formatted the same as
+    json.dumps(records, indent=indent), without loading all records at once.
+    """
+    prefix = ' ' * indent
+    count = 0
+    with open(json_filename, 'w', encoding='utf-8') as f:
+        for record in read_ndjson(ndjson_filename):
+            f.write('[\n' if count == 0 else ',\n')
+            f.write(textwrap.indent(json.dumps(record, indent=indent), prefix))
+            count += 1
+        f.write('\n]' if count > 0 else '[]')
+    return count
+
+def write_json_atomic(filename, data, indent=None):
+    """Writes data as JSON to a temporary file and renames it over filename."""
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_filename, filename)
+
+def truncate_ndjson(filename, count):
+    """
+    Cuts an NDJSON file down to its first count records, dropping anything written
+    after the last checkpoint. Returns the number of records kept.
+    """
+    kept = 0
+    offset = 0
+    with open(filename, 'rb') as f:
+        for line in f:
+            if kept == count or not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            kept += 1
+    with open(filename, 'r+b') as f:
+        f.truncate(offset)
+    return kept
+
+class Checkpoint:
+    """Crawl state saved as a small JSON file, replaced atomically on every save."""
+    def __init__(self, filename):
+        self.filename = filename
+
+    def load(self):
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save(self, state):
+        write_json_atomic(self.filename, state)
+
+    def clear(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)